@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   Stand-in for the collectd python module, so the plugins can be loaded
+#   and benchmarked outside of collectd. Dispatched values are counted,
+#   and kept in 'dispatched' when 'record' is set. Registered callbacks
+#   are kept in 'callbacks'.
+#
+import sys
+
+record = False
+dispatched = []
+count = 0
+
+def _log(level):
+    def log(msg):
+        sys.stderr.write("%s: %s\n" % (level, msg))
+    return log
+
+debug = _log('debug')
+info = _log('info')
+notice = _log('notice')
+warning = _log('warning')
+error = _log('error')
+
+class Values(object):
+
+    def __init__(self, type=None, values=None, plugin=None,
+            plugin_instance=None, type_instance=None, host=None,
+            time=None, interval=None):
+        self.type = type
+        self.values = values
+        self.plugin = plugin
+        self.plugin_instance = plugin_instance
+        self.type_instance = type_instance
+        self.host = host
+        self.time = time
+        self.interval = interval
+
+    def dispatch(self, **kwargs):
+        global count
+        count += 1
+        if record:
+            value = dict(self.__dict__)
+            value.update(kwargs)
+            # the plugins reuse their values list
+            value['values'] = list(value['values'])
+            dispatched.append(value)
+
+class Config(object):
+    """A config node, as handed to config callbacks."""
+
+    def __init__(self, key=None, values=(), children=(), parent=None):
+        self.key = key
+        self.values = tuple(values)
+        self.children = tuple(children)
+        self.parent = parent
+
+def reset():
+    global count
+    count = 0
+    del dispatched[:]
+
+callbacks = { 'config': [], 'init': [], 'read': [], 'shutdown': [] }
+
+def register_config(callback, *args, **kwargs):
+    callbacks['config'].append(callback)
+
+def register_init(callback, *args, **kwargs):
+    callbacks['init'].append(callback)
+
+def register_read(callback, *args, **kwargs):
+    callbacks['read'].append(callback)
+
+def register_shutdown(callback, *args, **kwargs):
+    callbacks['shutdown'].append(callback)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   Micro-benchmark of Base.dispatch, measuring the cost per metric of
+#   dispatching nova-like stats, against the previous nested dict walk
+#   allocating one collectd.Values per metric.
+#
+#   python bench/dispatch_bench.py [tenants] [rounds]
+#
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'plugins'))
+
+import collectd
+import base
+
+def make_stats(tenants):
+    data = { 'openstack-nova': { 'cluster': { 'config': {} } } }
+    for i in range(tenants):
+        data['openstack-nova']["tenant-%d" % i] = {
+            'limits': dict(("maxLimit%d" % j, float(j)) for j in range(16)),
+            'quotas': dict(("quota%d" % j, float(j)) for j in range(14)),
+        }
+    return data
+
+def legacy_dispatch(plugin, stats):
+    """The nested walk Base.dispatch used to do, kept for comparison."""
+    def dispatch_value(name, plugin_instance, type, type_instance, value):
+        plugin.logdebug("dispatching value %s.%s.%s.%s=%s"
+                % (name, plugin_instance, type, type_instance, value))
+        val = collectd.Values(type='gauge')
+        val.plugin=name
+        val.plugin_instance=plugin_instance
+        if type_instance is not None:
+            val.type_instance="%s-%s" % (type, type_instance)
+        else:
+            val.type_instance=type
+        val.values=[value]
+        val.interval = plugin.interval
+        val.dispatch()
+        plugin.logdebug("sent metric %s.%s.%s.%s.%s"
+                % (name, plugin_instance, type, type_instance, value))
+
+    for name in stats.keys():
+        for plugin_instance in stats[name].keys():
+            for type in stats[name][plugin_instance].keys():
+                for type_instance in stats[name][plugin_instance][type].keys():
+                    dispatch_value(name, plugin_instance, type, type_instance,
+                            stats[name][plugin_instance][type][type_instance])
+
+def measure(name, func, rounds):
+    best = None
+    for i in range(rounds):
+        collectd.reset()
+        start = time.time()
+        func()
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    print("%-10s %8d metrics  %8.1f ms  %6.3f us/metric"
+            % (name, collectd.count, best * 1000, best * 1e6 / collectd.count))
+
+def main():
+    tenants = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    stats = make_stats(tenants)
+    plugin = base.Base()
+    plugin.prefix = 'openstack-nova'
+
+    measure('legacy', lambda: legacy_dispatch(plugin, stats), rounds)
+    measure('dispatch', lambda: plugin.dispatch(stats), rounds)
+
+if __name__ == '__main__':
+    main()
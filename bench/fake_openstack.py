@@ -0,0 +1,595 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   Local stand-in for the parts of the Keystone, Nova, Cinder, Glance and
+#   Neutron APIs the plugins use, serving generated resources with a
+#   configurable per request latency and page size. Every service lives
+#   under its own path prefix of a single HTTP server:
+#
+#     /identity  /compute  /volumev2  /volume  /image  /network
+#
+#   Requests and response bytes are counted per service, and served as
+#   json on GET /_stats (POST /_reset clears them).
+#
+#   python bench/fake_openstack.py --port 5000 --tenants 1000
+#
+import argparse
+import datetime
+import json
+import re
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import urlencode
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, urlencode
+
+SERVICES = (
+    ('identity', 'keystone', 'identity'),
+    ('compute', 'nova', 'compute'),
+    ('volumev2', 'cinderv2', 'volumev2'),
+    ('volumev3', 'cinderv3', 'volume'),
+    ('image', 'glance', 'image'),
+    ('network', 'neutron', 'network'),
+)
+
+class Cloud(object):
+    """Generated resources, built once and served read-only."""
+
+    def __init__(self, tenants=10, users_per_tenant=3, hypervisors=None,
+            images=None, volumes=None, servers=None, ports=None,
+            networks_per_tenant=1, regions=('RegionOne',)):
+        self.regions = list(regions)
+        self.tenants = [{ 'id': "t%05d" % i, 'name': "tenant%05d" % i,
+                'enabled': True, 'description': '' } for i in range(tenants)]
+        self.users = []
+        self.assignments = []
+        for i, tenant in enumerate(self.tenants):
+            for j in range(users_per_tenant):
+                user = { 'id': "u%05d-%d" % (i, j), 'name': "user%05d-%d" % (i, j),
+                        'enabled': True, 'tenantId': tenant['id'], 'email': None }
+                self.users.append(user)
+                self.assignments.append((user['id'], tenant['id']))
+        self.users_by_tenant = {}
+        for user in self.users:
+            self.users_by_tenant.setdefault(user['tenantId'], []).append(user)
+
+        tenant_ids = [tenant['id'] for tenant in self.tenants] or ['admin']
+        owner = lambda i: tenant_ids[i % len(tenant_ids)]
+        if hypervisors is None:
+            hypervisors = max(1, tenants // 20)
+        self.hypervisors = [{
+            'id': i, 'hypervisor_hostname': "compute%d.example.com" % i,
+            'hypervisor_type': 'QEMU', 'hypervisor_version': 2005000,
+            'current_workload': 0, 'free_disk_gb': 900, 'free_ram_mb': 200000,
+            'memory_mb': 256000, 'memory_mb_used': 56000, 'running_vms': 10,
+            'vcpus': 48, 'vcpus_used': 20, 'local_gb': 1000, 'local_gb_used': 100,
+            'disk_available_least': 900, 'cpu_info': '', 'host_ip': '10.0.0.1',
+            'state': 'up', 'status': 'enabled',
+            'service': { 'id': i, 'host': "compute%d" % i, 'disabled_reason': None },
+        } for i in range(hypervisors)]
+        self.aggregates = [{
+            'id': 1, 'name': 'windows', 'availability_zone': None,
+            'hosts': ["compute%d" % i for i in range(0, hypervisors, 10)],
+            'metadata': { 'os_distro': 'windows' },
+        }]
+        self.flavors = [{ 'id': str(i + 1), 'name': "m1.flavor%d" % i,
+                'vcpus': 2 ** i, 'ram': 512 * 2 ** i, 'disk': 10 * 2 ** i,
+                'links': [] } for i in range(5)]
+        # not listed any more, still shown and used by some servers
+        self.deleted_flavors = [{ 'id': '100', 'name': 'm1.retired', 'vcpus': 1,
+                'ram': 256, 'disk': 5, 'links': [] }]
+
+        updated = '2015-01-01T00:00:00.000000'
+        # one second apart, so changes-since listings only return the latest
+        def stamp(i):
+            return (datetime.datetime(2015, 1, 1) + datetime.timedelta(seconds=i)).isoformat()
+        if servers is None:
+            servers = 2 * tenants
+        self.servers = [{
+            'id': "s%07d" % i, 'name': "server%d" % i, 'tenant_id': owner(i),
+            'user_id': 'admin', 'status': ('ACTIVE', 'ACTIVE', 'SHUTOFF', 'ERROR')[i % 4],
+            'flavor': { 'id': (self.flavors[i % len(self.flavors)] if i % 10
+                    else self.deleted_flavors[0])['id'], 'links': [] },
+            'image': { 'id': "i%07d" % i, 'links': [] }, 'metadata': {},
+            'addresses': {}, 'links': [], 'updated': updated, 'created': updated,
+            'OS-EXT-SRV-ATTR:host': "compute%d" % (i % hypervisors),
+            'OS-EXT-SRV-ATTR:hypervisor_hostname': "compute%d.example.com" % (i % hypervisors),
+        } for i in range(servers)]
+
+        if images is None:
+            images = 2 * tenants
+        self.images = [{
+            'id': "i%07d" % i, 'name': "image%d" % i, 'owner': owner(i),
+            'size': 1024 * 1024 * (i % 100 + 1), 'status': 'active',
+            'visibility': 'private', 'disk_format': 'qcow2',
+            'container_format': 'bare', 'tags': [], 'min_disk': 0, 'min_ram': 0,
+            'protected': False, 'checksum': None, 'created_at': updated,
+            'updated_at': stamp(i), 'file': "/v2/images/i%07d/file" % i,
+            'self': "/v2/images/i%07d" % i, 'schema': '/v2/schemas/image',
+        } for i in range(images)]
+
+        if volumes is None:
+            volumes = 2 * tenants
+        self.volumes = [{
+            'id': "v%07d" % i, 'name': "volume%d" % i, 'size': i % 50 + 1,
+            'status': 'in-use' if i % 3 else 'available',
+            'volume_type': ('ssd', 'hdd')[i % 2], 'bootable': 'false',
+            'os-vol-tenant-attr:tenant_id': owner(i),
+            'os-vol-host-attr:host': "cinder%d@%s#pool" % (i % 3, ('ssd', 'hdd')[i % 2]),
+            'attachments': [], 'metadata': {}, 'links': [],
+            'created_at': updated, 'updated_at': stamp(i),
+        } for i in range(volumes)]
+        self.snapshots = [{
+            'id': "sn%07d" % i, 'volume_id': volume['id'], 'size': volume['size'],
+            'status': 'available', 'name': None, 'metadata': {},
+            'os-extended-snapshot-attributes:project_id': volume['os-vol-tenant-attr:tenant_id'],
+            'created_at': updated, 'updated_at': updated,
+        } for i, volume in enumerate(self.volumes[::4])]
+
+        self.networks = []
+        self.subnets = []
+        for i in range(networks_per_tenant * len(tenant_ids)):
+            subnet = { 'id': "sub%07d" % i, 'tenant_id': owner(i),
+                    'network_id': "n%07d" % i, 'cidr': '10.0.0.0/24',
+                    'ip_version': 4, 'name': '' }
+            self.subnets.append(subnet)
+            self.networks.append({ 'id': "n%07d" % i, 'name': "net%d" % i,
+                'tenant_id': owner(i), 'subnets': [subnet['id']],
+                'status': 'ACTIVE', 'admin_state_up': True, 'shared': False })
+        if ports is None:
+            ports = 4 * tenants
+        self.ports = [{ 'id': "p%07d" % i, 'tenant_id': owner(i),
+                'network_id': "n%07d" % (i % max(1, len(self.networks))),
+                'device_owner': 'compute:nova', 'device_id': "s%07d" % i,
+                'status': 'ACTIVE', 'mac_address': 'fa:16:3e:00:00:00',
+                'fixed_ips': [{ 'subnet_id': '', 'ip_address': '10.0.0.2' }],
+                'admin_state_up': True, 'name': '' } for i in range(ports)]
+        self.routers = [{ 'id': "r%07d" % i, 'tenant_id': tenant_id,
+                'name': '', 'status': 'ACTIVE', 'admin_state_up': True,
+                'external_gateway_info': None } for i, tenant_id in enumerate(tenant_ids)]
+        self.floatingips = [{ 'id': "f%07d" % i, 'tenant_id': tenant_id,
+                'floating_ip_address': '192.168.0.1', 'floating_network_id': '',
+                'router_id': None, 'port_id': None, 'fixed_ip_address': None,
+                'status': 'DOWN' } for i, tenant_id in enumerate(tenant_ids)]
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+
+        if path == '/_stats':
+            return self.reply(200, server.get_stats(), count=False)
+        if path == '/_reset':
+            server.reset_stats()
+            return self.reply(200, {}, count=False)
+
+        if server.latency:
+            time.sleep(server.latency)
+        service = path.split('/')[1] if path.count('/') else ''
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                status, body = handler(server, query, *match.groups())
+                return self.reply(status, body, service)
+        self.reply(404, { 'error': { 'message': "no route for %s %s" % (method, path) } }, service)
+
+    def reply(self, status, body, service=None, count=True):
+        payload = json.dumps(body).encode('utf-8')
+        if count:
+            self.server.count(service, len(payload))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class FakeOpenStack(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, cloud, latency=0.0, page_max=1000, token_ttl=3600):
+        HTTPServer.__init__(self, address, Handler)
+        self.cloud = cloud
+        self.latency = latency
+        self.page_max = page_max
+        self.token_ttl = token_ttl
+        self.url = "http://%s:%d" % (address[0] or '127.0.0.1', self.server_address[1])
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def count(self, service, size):
+        with self._lock:
+            calls, sent = self.stats.get(service, (0, 0))
+            self.stats[service] = (calls + 1, sent + size)
+
+    def reset_stats(self):
+        self.stats = {}
+
+    def get_stats(self):
+        with self._lock:
+            return dict((service, { 'calls': calls, 'bytes': sent })
+                    for service, (calls, sent) in self.stats.items())
+
+    def paginate(self, items, query):
+        """Returns the page of items after query's marker, and whether more follow."""
+        limit = min(int(query.get('limit', [self.page_max])[0]), self.page_max)
+        start = 0
+        marker = query.get('marker', [None])[0]
+        if marker is not None:
+            for i, item in enumerate(items):
+                if item['id'] == marker:
+                    start = i + 1
+                    break
+        page = items[start:start + limit]
+        return page, start + limit < len(items)
+
+    def next_link(self, path, query, page):
+        params = dict((key, values) for key, values in query.items() if key != 'marker')
+        params['marker'] = [page[-1]['id']]
+        params.setdefault('limit', [str(len(page))])
+        return "%s?%s" % (path, urlencode(params, doseq=True))
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+ROUTES = []
+
+def route(method, pattern):
+    def register(handler):
+        ROUTES.append((method, re.compile('^%s$' % pattern), handler))
+        return handler
+    return register
+
+def filtered(items, query, fields=()):
+    for key in fields:
+        if key in query:
+            items = [item for item in items if item.get(key) == query[key][0]]
+    return items
+
+def ordered(items, query):
+    """
+    Sorts items by the sort_key and sort_dir, or sort=<key>:<dir>, query
+    arguments, newest created first by default, like the real APIs.
+    """
+    if 'sort' in query:
+        key, _, direction = query['sort'][0].partition(':')
+    else:
+        key = query.get('sort_key', ['created_at'])[0]
+        direction = query.get('sort_dir', ['desc'])[0]
+    return sorted(items, key=lambda item: (item[key], item['id']),
+            reverse=direction != 'asc')
+
+def changed(items, query):
+    """Filters items by the changes-since or updated_at=gte: query arguments."""
+    since = query.get('changes-since', query.get('updated_at', [None]))[0]
+    if since is None:
+        return items
+    if since.startswith('gte:'):
+        since = since[4:]
+    return [item for item in items if item['updated_at'] >= since]
+
+# Keystone
+
+def version(server, name, status='stable'):
+    return { 'id': name, 'status': status, 'updated': '2015-01-01T00:00:00Z',
+            'links': [{ 'rel': 'self', 'href': "%s/identity/%s/" % (server.url, name[:2]) }],
+            'media-types': [{ 'base': 'application/json',
+                'type': "application/vnd.openstack.identity-%s+json" % name }] }
+
+@route('GET', '/identity')
+def identity_versions(server, query):
+    return 300, { 'versions': { 'values': [
+        dict(version(server, 'v3.0'), links=[{ 'rel': 'self', 'href': server.url + '/identity/v3/' }]),
+        dict(version(server, 'v2.0'), links=[{ 'rel': 'self', 'href': server.url + '/identity/v2.0/' }]),
+    ] } }
+
+@route('GET', '/identity/v2.0')
+def identity_v2(server, query):
+    return 200, { 'version': dict(version(server, 'v2.0'),
+        links=[{ 'rel': 'self', 'href': server.url + '/identity/v2.0/' }]) }
+
+@route('GET', '/identity/v3')
+def identity_v3(server, query):
+    return 200, { 'version': dict(version(server, 'v3.0'),
+        links=[{ 'rel': 'self', 'href': server.url + '/identity/v3/' }]) }
+
+@route('POST', '/identity/v2.0/tokens')
+def tokens(server, query):
+    expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=server.token_ttl)
+    catalog = []
+    for service_type, name, prefix in SERVICES:
+        endpoints = []
+        for region in server.cloud.regions:
+            url = "%s/%s" % (server.url, prefix)
+            if service_type == 'identity':
+                url += '/v2.0'
+            elif service_type in ('compute', 'volumev2'):
+                url += '/v2/admin'
+            elif service_type == 'volumev3':
+                url += '/v3/admin'
+            endpoints.append({ 'region': region, 'publicURL': url,
+                'internalURL': url, 'adminURL': url, 'id': name })
+        catalog.append({ 'type': service_type, 'name': name,
+            'endpoints': endpoints, 'endpoints_links': [] })
+    return 200, { 'access': {
+        'token': { 'id': 'fake-token', 'issued_at': datetime.datetime.utcnow().isoformat(),
+            'expires': expires.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'tenant': { 'id': 'admin', 'name': 'openstack', 'enabled': True } },
+        'serviceCatalog': catalog,
+        'user': { 'id': 'admin', 'name': 'admin', 'username': 'admin',
+            'roles': [{ 'name': 'admin' }], 'roles_links': [] },
+        'metadata': { 'is_admin': 0, 'roles': ['admin'] },
+    } }
+
+@route('GET', '/identity/v2.0/tenants')
+def tenants(server, query):
+    return 200, { 'tenants': server.cloud.tenants, 'tenants_links': [] }
+
+@route('GET', '/identity/v2.0/tenants/([^/]+)/users')
+def tenant_users(server, query, tenant_id):
+    return 200, { 'users': server.cloud.users_by_tenant.get(tenant_id, []) }
+
+@route('GET', '/identity/v2.0/users')
+def users(server, query):
+    return 200, { 'users': server.cloud.users }
+
+@route('GET', '/identity/v2.0/OS-KSADM/roles')
+def roles(server, query):
+    return 200, { 'roles': [{ 'id': 'admin', 'name': 'admin' },
+        { 'id': 'member', 'name': '_member_' }] }
+
+@route('GET', '/identity/v2.0/OS-KSADM/services')
+def services(server, query):
+    return 200, { 'OS-KSADM:services': [{ 'id': name, 'name': name,
+        'type': service_type, 'description': '' }
+        for service_type, name, prefix in SERVICES] }
+
+@route('GET', '/identity/v2.0/endpoints')
+def endpoints(server, query):
+    return 200, { 'endpoints': [{ 'id': name, 'service_id': name,
+        'region': region, 'publicurl': '', 'adminurl': '', 'internalurl': '' }
+        for service_type, name, prefix in SERVICES for region in server.cloud.regions] }
+
+@route('GET', '/identity/v3/role_assignments')
+def role_assignments(server, query):
+    return 200, { 'role_assignments': [{ 'user': { 'id': user_id },
+        'scope': { 'project': { 'id': project_id } }, 'role': { 'id': 'member' },
+        'links': { 'assignment': '' } } for user_id, project_id in server.cloud.assignments],
+        'links': { 'self': '', 'previous': None, 'next': None } }
+
+# Nova
+
+@route('GET', '/compute/v2/[^/]+/limits')
+def limits(server, query):
+    return 200, { 'limits': { 'rate': [], 'absolute': {
+        'maxServerMeta': 128, 'maxPersonality': 5, 'maxImageMeta': 128,
+        'maxPersonalitySize': 10240, 'maxSecurityGroupRules': 20,
+        'maxTotalKeypairs': 100, 'maxSecurityGroups': 10, 'maxTotalCores': 20,
+        'maxTotalFloatingIps': 10, 'maxTotalInstances': 10, 'maxTotalRAMSize': 51200,
+        'totalCoresUsed': 2, 'totalRAMUsed': 4096, 'totalInstancesUsed': 1,
+        'totalFloatingIpsUsed': 0, 'totalSecurityGroupsUsed': 1,
+    } } }
+
+@route('GET', '/compute/v2/[^/]+/os-quota-sets/([^/]+)')
+def nova_quotas(server, query, tenant_id):
+    return 200, { 'quota_set': { 'id': tenant_id, 'cores': 20, 'fixed_ips': -1,
+        'floating_ips': 10, 'instances': 10, 'key_pairs': 100, 'ram': 51200,
+        'security_groups': 10, 'security_group_rules': 20, 'injected_files': 5,
+        'injected_file_content_bytes': 10240, 'injected_file_path_bytes': 255,
+        'metadata_items': 128 } }
+
+@route('GET', '/compute/v2/[^/]+/os-hypervisors/detail')
+def hypervisors(server, query):
+    return 200, { 'hypervisors': server.cloud.hypervisors }
+
+@route('GET', '/compute/v2/[^/]+/os-aggregates')
+def aggregates(server, query):
+    return 200, { 'aggregates': server.cloud.aggregates }
+
+@route('GET', '/compute/v2/[^/]+/flavors/detail')
+def flavors(server, query):
+    return 200, { 'flavors': server.cloud.flavors }
+
+@route('GET', '/compute/v2/[^/]+/flavors/([^/]+)')
+def flavor(server, query, flavor_id):
+    for item in server.cloud.flavors + server.cloud.deleted_flavors:
+        if item['id'] == flavor_id:
+            return 200, { 'flavor': item }
+    return 404, { 'itemNotFound': { 'code': 404,
+        'message': "Flavor %s could not be found." % flavor_id } }
+
+@route('GET', '/compute/v2/[^/]+/servers/detail')
+def servers(server, query):
+    items = filtered(server.cloud.servers, query, ('tenant_id',))
+    page, more = server.paginate(items, query)
+    body = { 'servers': page }
+    if more:
+        body['servers_links'] = [{ 'rel': 'next',
+            'href': server.next_link(server.url + '/compute/v2/admin/servers/detail', query, page) }]
+    return 200, body
+
+# Cinder
+
+@route('GET', '/volumev2/v2/[^/]+/os-quota-sets/([^/]+)')
+def cinder_quotas(server, query, tenant_id):
+    return 200, { 'quota_set': { 'id': tenant_id,
+        'gigabytes': { 'in_use': 10, 'limit': 1000, 'reserved': 0 },
+        'snapshots': { 'in_use': 1, 'limit': 10, 'reserved': 0 },
+        'volumes': { 'in_use': 2, 'limit': 10, 'reserved': 0 } } }
+
+def cinder_list(server, query, collection, items, api='volumev2/v2'):
+    items = filtered(items, query, ('status',))
+    if api != 'volumev2/v2':
+        # updated_at filters, from volume API 3.60
+        items = changed(items, query)
+    items = ordered(items, query)
+    page, more = server.paginate(items, query)
+    body = { collection: page }
+    if more:
+        body["%s_links" % collection] = [{ 'rel': 'next', 'href': server.next_link(
+            "%s/%s/admin/%s/detail" % (server.url, api, collection), query, page) }]
+    return 200, body
+
+@route('GET', '/volumev2/v2/[^/]+/volumes/detail')
+def volumes(server, query):
+    return cinder_list(server, query, 'volumes', server.cloud.volumes)
+
+@route('GET', '/volumev2/v2/[^/]+/snapshots/detail')
+def snapshots(server, query):
+    return cinder_list(server, query, 'snapshots', server.cloud.snapshots)
+
+@route('GET', '/volume/?')
+def volume_versions(server, query):
+    return 300, { 'versions': [{ 'id': 'v3.0', 'status': 'CURRENT',
+        'version': '3.60', 'min_version': '3.0', 'updated': '2020-04-01T00:00:00Z',
+        'links': [{ 'rel': 'self', 'href': server.url + '/volume/v3/' }] }] }
+
+@route('GET', '/volume/v3/[^/]+/volumes/detail')
+def volumes_v3(server, query):
+    return cinder_list(server, query, 'volumes', server.cloud.volumes, 'volume/v3')
+
+@route('GET', '/volume/v3/[^/]+/snapshots/detail')
+def snapshots_v3(server, query):
+    return cinder_list(server, query, 'snapshots', server.cloud.snapshots, 'volume/v3')
+
+# Glance
+
+@route('GET', '/image')
+def image_versions(server, query):
+    return 300, { 'versions': [{ 'id': 'v2.0', 'status': 'CURRENT',
+        'links': [{ 'rel': 'self', 'href': server.url + '/image/v2/' }] }] }
+
+@route('GET', '/image/v2/schemas/image')
+def image_schema(server, query):
+    return 200, { 'name': 'image', 'additionalProperties': { 'type': 'string' },
+        'properties': dict((key, {}) for key in server.cloud.images[0]) if server.cloud.images else {},
+        'links': [] }
+
+@route('GET', '/image/v2/images')
+def images(server, query):
+    items = ordered(changed(filtered(server.cloud.images, query, ('owner',)), query), query)
+    page, more = server.paginate(items, query)
+    body = { 'images': page, 'first': '/v2/images', 'schema': '/v2/schemas/images' }
+    if more:
+        body['next'] = server.next_link('/v2/images', query, page)
+    return 200, body
+
+# Neutron
+
+def neutron_list(collection):
+    def handler(server, query):
+        items = filtered(getattr(server.cloud, collection), query, ('tenant_id',))
+        page, more = server.paginate(items, query)
+        if 'fields' in query:
+            fields = query['fields']
+            page_body = [dict((key, item[key]) for key in fields if key in item) for item in page]
+        else:
+            page_body = page
+        body = { collection: page_body }
+        if more:
+            body["%s_links" % collection] = [{ 'rel': 'next', 'href': server.next_link(
+                "%s/network/v2.0/%s" % (server.url, collection), query, page) }]
+        return 200, body
+    route('GET', '/network/v2.0/%s' % collection)(handler)
+    route('GET', '/network/v2.0/%s\\.json' % collection)(handler)
+
+for collection in ('networks', 'subnets', 'ports', 'routers', 'floatingips'):
+    neutron_list(collection)
+
+def neutron_quotas(server, query):
+    return 200, { 'quotas': [{ 'tenant_id': tenant['id'], 'floatingip': 50,
+        'ikepolicy': -1, 'ipsec_site_connection': -1, 'ipsecpolicy': -1,
+        'network': 10, 'port': 50, 'router': 10, 'security_group': 10,
+        'security_group_rule': 100, 'subnet': 10 } for tenant in server.cloud.tenants] }
+
+route('GET', '/network/v2.0/quotas')(neutron_quotas)
+route('GET', '/network/v2.0/quotas\\.json')(neutron_quotas)
+
+def add_arguments(parser, tenants=True):
+    """Adds the options shaping the fake cloud to an argparse parser."""
+    if tenants:
+        parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--users-per-tenant', type=int, default=3)
+    parser.add_argument('--hypervisors', type=int, default=None,
+            help='default: one per 20 tenants')
+    parser.add_argument('--images', type=int, default=None,
+            help='default: two per tenant')
+    parser.add_argument('--volumes', type=int, default=None,
+            help='default: two per tenant')
+    parser.add_argument('--servers', type=int, default=None,
+            help='default: two per tenant')
+    parser.add_argument('--ports', type=int, default=None,
+            help='default: four per tenant')
+    parser.add_argument('--regions', default='RegionOne',
+            help='comma separated region names')
+    parser.add_argument('--latency', type=float, default=0.0,
+            help='seconds added to every request')
+    parser.add_argument('--page-max', type=int, default=1000,
+            help='largest page served by paginated listings')
+    parser.add_argument('--token-ttl', type=int, default=3600)
+
+def from_arguments(args, host='127.0.0.1', port=0):
+    """Returns a FakeOpenStack server built from parsed add_arguments options."""
+    cloud = Cloud(tenants=args.tenants, users_per_tenant=args.users_per_tenant,
+            hypervisors=args.hypervisors, images=args.images,
+            volumes=args.volumes, servers=args.servers, ports=args.ports,
+            regions=args.regions.split(','))
+    return FakeOpenStack((host, port), cloud, latency=args.latency,
+            page_max=args.page_max, token_ttl=args.token_ttl)
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenStack API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, args.host, args.port)
+    print("serving on %s, auth url %s/identity/v2.0" % (server.url, server.url))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   Measures the list throughput of the neutron, glance and keystone bulk
+#   listings against the fake OpenStack API, through the client libraries
+#   and through the asyncio fetch engine (AsyncFetch), which prefetches
+#   the next page while the current one is processed, and fetches the
+#   four neutron listings of a read at once ('neutron'). Items are counted
+#   as they come, as the plugins do, and the peak of the memory allocated
+#   meanwhile is reported, which should stay bounded by the page size.
+#   Set a --latency for the fake API, without which prefetching can't help.
+#
+#   python bench/fetch_bench.py --tenants 10000 --latency 0.02 --page-size 500
+#
+import argparse
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(1, os.path.join(BENCH_DIR, '..', 'plugins'))
+
+import base
+import fake_openstack
+
+def listings():
+    """Returns (name, plugin, list function) of the listings to measure."""
+    import glance_plugin
+    import neutron_plugin
+    neutron = neutron_plugin.NeutronPlugin()
+    glance = glance_plugin.GlancePlugin()
+
+    def neutron_list(collection, fields):
+        def run():
+            client = neutron.get_client('neutron', lambda session:
+                    base.client_class('neutron')('2.0', session=session))
+            return sum(1 for resource in neutron.list_all_paged(client,
+                    [(collection, fields)]))
+        return run
+
+    def neutron_all():
+        client = neutron.get_client('neutron', lambda session:
+                base.client_class('neutron')('2.0', session=session))
+        return sum(1 for resource in neutron.list_all_paged(client,
+                (('networks', ['tenant_id', 'subnets']), ('routers', ['tenant_id']),
+                 ('ports', ['tenant_id']), ('floatingips', ['tenant_id']))))
+
+    def glance_list():
+        client = glance.get_client('glance', lambda session:
+                base.client_class('glance')(glance.get_endpoint('image'), session=session))
+        return sum(1 for image in glance.list_images(client))
+
+    def tenants_list():
+        return len(neutron._fetch_tenants())
+
+    return [('ports', neutron, neutron_list('ports', ['tenant_id'])),
+            ('networks', neutron, neutron_list('networks', ['tenant_id', 'subnets'])),
+            ('neutron', neutron, neutron_all),
+            ('images', glance, glance_list),
+            ('tenants', neutron, tenants_list)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the list endpoints')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=3)
+    fake_openstack.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = fake_openstack.from_arguments(args)
+    server.start()
+    print("%-9s %-7s %8s %7s %9s %11s %9s" % ('listing', 'engine', 'items', 'calls',
+            'best(s)', 'items/s', 'peak(MB)'))
+    for name, plugin, run in listings():
+        plugin.auth_url = server.url + '/identity/v2.0'
+        plugin.page_size = args.page_size
+        for engine in ('client', 'async'):
+            plugin.async_fetch = engine == 'async'
+            best = None
+            peak = None
+            for i in range(args.rounds):
+                server.reset_stats()
+                if tracemalloc is not None:
+                    tracemalloc.start()
+                start = time.time()
+                items = run()
+                took = time.time() - start
+                if tracemalloc is not None:
+                    peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                if best is None or took < best:
+                    best = took
+            calls = sum(service['calls'] for service in server.get_stats().values())
+            print("%-9s %-7s %8d %7d %9.3f %11.0f %9s" % (name, engine, items, calls,
+                    best, items / best if best else 0,
+                    "%.1f" % (peak / 1e6) if peak is not None else 'n/a'))
+    server.shutdown()
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   Runs the plugins against the fake OpenStack API, and reports for each
+#   the wall time, API calls, bytes transferred, peak RSS and metrics
+#   dispatched. Each plugin runs in its own process, with the stand-in
+#   collectd module, so its peak RSS isn't mixed with the fake API's.
+#   Startup, up to register_read, is measured separately: the time to
+#   import the plugin, the RSS once configured and the client libraries
+#   already imported by then, with --import-time listing the slowest
+#   imports (python -X importtime, python 3.7+).
+#
+#   python bench/run.py --tenants 10,1000,10000 --plugins nova,glance \
+#       --option Concurrency=8 --option Bulk=true
+#
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import fake_openstack
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGINS_DIR = os.path.join(BENCH_DIR, '..', 'plugins')
+PLUGINS = ('keystone', 'nova', 'cinder', 'glance', 'neutron')
+
+# top level packages of the client libraries and requests, imported lazily
+# by the plugins
+CLIENT_PACKAGES = ('keystoneclient', 'novaclient', 'cinderclient', 'glanceclient',
+        'neutronclient', 'requests')
+
+def current_rss():
+    """Returns the resident set size of this process, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# options the nova plugin expects to always be configured
+NOVA_OPTIONS = (('AllocationRatioCores', '16'), ('AllocationRatioRam', '1.5'),
+        ('ReservedNodeCores', '0'), ('ReservedNodeRamMB', '0'),
+        ('ReservedCores', '0'), ('ReservedRamMB', '0'))
+
+def child(args):
+    """Loads one plugin, configures it and runs its read callbacks."""
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(1, PLUGINS_DIR)
+    import collectd
+
+    start = time.time()
+    __import__("%s_plugin" % args.plugin)
+    imported = time.time() - start
+
+    children = [collectd.Config('Username', ['admin']),
+            collectd.Config('Password', ['secret']),
+            collectd.Config('TenantName', ['openstack']),
+            collectd.Config('AuthURL', [args.auth_url])]
+    ticks = 1
+    if args.plugin == 'openstack':
+        # the unified plugin runs one service per read callback
+        services = args.services.split(',')
+        ticks = len(services)
+        for service in services:
+            options = NOVA_OPTIONS if service == 'nova' else ()
+            children.append(collectd.Config('Service', [service],
+                [collectd.Config(key, [value]) for key, value in options]))
+    elif args.plugin == 'nova':
+        children += [collectd.Config(key, [value]) for key, value in NOVA_OPTIONS]
+    for option in args.option:
+        key, value = option.split('=', 1)
+        children.append(collectd.Config(key, value.split(',')))
+    for callback in collectd.callbacks['config']:
+        callback(collectd.Config(children=children))
+    for callback in collectd.callbacks['init']:
+        callback()
+    startup_rss = current_rss()
+    loaded = [package for package in CLIENT_PACKAGES if package in sys.modules]
+
+    reads = []
+    for i in range(args.reads):
+        start = time.time()
+        for tick in range(ticks):
+            for callback in collectd.callbacks['read']:
+                callback()
+        reads.append(time.time() - start)
+        if i + 1 < args.reads:
+            time.sleep(args.read_interval)
+    for callback in collectd.callbacks['shutdown']:
+        callback()
+
+    # ru_maxrss is in kilobytes on linux
+    print(json.dumps({ 'import': imported, 'reads': reads,
+        'metrics': collectd.count, 'startup_rss': startup_rss, 'startup_clients': loaded,
+        'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 }))
+
+def run_plugin(server, plugin, args):
+    server.reset_stats()
+    command = [sys.executable]
+    if args.import_time:
+        command += ['-X', 'importtime']
+    command += [os.path.abspath(__file__), '--child',
+            '--plugin', plugin, '--auth-url', server.url + '/identity/v2.0',
+            '--reads', str(args.reads), '--read-interval', str(args.read_interval),
+            '--services', args.services]
+    for option in args.option:
+        command += ['--option', option]
+    start = time.time()
+    stderr = None if args.verbose else open(os.devnull, 'w')
+    if args.import_time:
+        stderr = subprocess.PIPE
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+    output, errors = process.communicate()
+    wall = time.time() - start
+    if process.returncode != 0:
+        return None
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['wall'] = wall
+    if args.import_time:
+        result['imports'] = slowest_imports(errors.decode('utf-8'), args.import_time)
+    stats = server.get_stats()
+    result['calls'] = sum(service['calls'] for service in stats.values())
+    result['bytes'] = sum(service['bytes'] for service in stats.values())
+    return result
+
+def slowest_imports(output, count):
+    """
+    Returns the count top level imports with the highest cumulative time,
+    in seconds, from the output of python -X importtime.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1]) / 1e6
+        except (IndexError, ValueError):
+            # the header line
+            continue
+        name = fields[2].rstrip()
+        if not name.startswith('  '):
+            imports.append((cumulative, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the collectd-openstack plugins')
+    parser.add_argument('--plugins', default=','.join(PLUGINS),
+            help="plugins to run, 'openstack' being the unified plugin")
+    parser.add_argument('--services', default=','.join(PLUGINS),
+            help='services enabled in the unified plugin')
+    parser.add_argument('--option', action='append', default=[],
+            help='plugin config option, as Key=Value, may be repeated')
+    parser.add_argument('--reads', type=int, default=1,
+            help='read callbacks to run per plugin')
+    parser.add_argument('--read-interval', type=float, default=0.0,
+            help='seconds to wait between reads')
+    parser.add_argument('--verbose', action='store_true',
+            help='show the plugins log output')
+    parser.add_argument('--json', action='store_true',
+            help='print results as json lines')
+    parser.add_argument('--import-time', type=int, default=0, metavar='COUNT',
+            help='list the COUNT slowest imports of each plugin')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--plugin', help=argparse.SUPPRESS)
+    parser.add_argument('--auth-url', help=argparse.SUPPRESS)
+    parser.add_argument('--tenants', dest='tenant_counts', default='10,1000,10000',
+            help='comma separated tenant counts')
+    fake_openstack.add_arguments(parser, tenants=False)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    if not args.json:
+        print("%-9s %7s %9s %9s %8s %11s %9s %8s %9s %10s  %s" % ('plugin', 'tenants',
+                'wall(s)', 'read(s)', 'calls', 'bytes', 'rss(MB)', 'metrics',
+                'import(s)', 'start(MB)', 'clients at start'))
+    for tenants in [int(count) for count in args.tenant_counts.split(',')]:
+        args.tenants = tenants
+        server = fake_openstack.from_arguments(args)
+        server.start()
+        for plugin in args.plugins.split(','):
+            result = run_plugin(server, plugin, args)
+            if result is None:
+                print("%-9s %7d failed (rerun with --verbose)" % (plugin, tenants))
+                continue
+            result.update(plugin=plugin, tenants=tenants)
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print("%-9s %7d %9.2f %9.2f %8d %11d %9.1f %8d %9.3f %10.1f  %s" % (plugin,
+                    tenants, result['wall'], sum(result['reads']), result['calls'],
+                    result['bytes'], result['maxrss'] / 1048576.0, result['metrics'],
+                    result['import'], result['startup_rss'] / 1048576.0,
+                    ','.join(result['startup_clients']) or '-'))
+            for cumulative, name in result.get('imports', ()):
+                print("%19s %9.3f %s" % ('', cumulative, name))
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
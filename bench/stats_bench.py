@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   Micro-benchmark of the memory held by the stats of one nova limits and
+#   quotas collection, as nested dicts per tenant against a
+#   base.StatsTable, along with the time to build and flatten them and the
+#   garbage collections triggered, then to dispatch them and the garbage
+#   collections this triggers. Then measures the memory the nova plugin
+#   itself retains between reads, stats and last known values included,
+#   collecting limits and quotas from an in-process stand-in for novaclient.
+#
+#   python bench/stats_bench.py [tenants]
+#
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', 'plugins'))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import base
+
+LIMITS = ["maxLimit%d" % j for j in range(16)]
+QUOTAS = ["quota%d" % j for j in range(14)]
+
+def make_dicts(tenants):
+    data = { 'openstack-nova': {} }
+    for i in range(tenants):
+        data['openstack-nova']["tenant-%d" % i] = {
+            'limits': dict((name, float(j)) for j, name in enumerate(LIMITS)),
+            'quotas': dict((name, float(j)) for j, name in enumerate(QUOTAS)),
+        }
+    return data
+
+def make_table(tenants):
+    table = base.StatsTable(["limits-%s" % name for name in LIMITS] +
+            ["quotas-%s" % name for name in QUOTAS])
+    columns = table.columns
+    for i in range(tenants):
+        row = table.add_row("tenant-%d" % i)
+        for j, values in enumerate(columns):
+            values[row] = float(j % 16)
+    return { 'openstack-nova': table }
+
+def gc_runs():
+    if not hasattr(gc, 'get_stats'):
+        return None
+    return sum(stat['collections'] for stat in gc.get_stats())
+
+def count_flat(flat):
+    return sum(len(metrics) + sum(table.count() for table in tables)
+            for plugin, metrics, tables in flat)
+
+def measure(name, make, tenants):
+    plugin = base.Base()
+    plugin.prefix = 'openstack-nova'
+    gc.collect()
+    collections = gc_runs()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    stats = make(tenants)
+    built = time.time() - start
+    size = tracemalloc.get_traced_memory()[0] if tracemalloc is not None else None
+    start = time.time()
+    flat = plugin.flatten(stats)
+    flattened = time.time() - start
+    if tracemalloc is not None:
+        tracemalloc.stop()
+    if collections is not None:
+        collections = gc_runs() - collections
+
+    # what dispatching costs on top, the flattening included
+    gc.collect()
+    dispatch_collections = gc_runs()
+    start = time.time()
+    plugin.dispatch(stats)
+    dispatched = time.time() - start
+    if dispatch_collections is not None:
+        dispatch_collections = gc_runs() - dispatch_collections
+    print("%-6s %8d metrics  %8s  build %7.1f ms  flatten %7.1f ms  %4s gc runs  "
+            "dispatch %7.1f ms  %4s gc runs"
+            % (name, count_flat(flat),
+            "%.1f MB" % (size / 1e6) if size is not None else 'n/a',
+            built * 1000, flattened * 1000,
+            collections if collections is not None else 'n/a',
+            dispatched * 1000,
+            dispatch_collections if dispatch_collections is not None else 'n/a'))
+    return stats
+
+class Resource(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class FakeNova(object):
+    """Returns novaclient like limits and quotas, built on each call."""
+
+    def __init__(self):
+        self.limits = Resource(get=lambda tenant_id: Resource(absolute=[
+            Resource(name=name, value=j) for j, name in enumerate(LIMITS)]))
+        self.quotas = Resource(get=lambda tenant_id: Resource(**dict(
+            (name, j) for j, name in enumerate(('cores', 'fixed_ips', 'floating_ips',
+                'instances', 'key_pairs', 'ram', 'security_groups')))))
+
+def plugin_run(tenants):
+    """Measures what the nova plugin retains after collecting limits and quotas."""
+    import nova_plugin
+    plugin = nova_plugin.NovaPlugin()
+    plugin.groups = ('tenant_limits', 'tenant_quotas')
+    tenant_list = [base.Tenant("id%d" % i, "tenant%d" % i) for i in range(tenants)]
+    client = FakeNova()
+    plugin.get_tenants = lambda: tenant_list
+    plugin.get_nova = lambda: client
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    for i in range(2):
+        plugin._group_times = {}
+        start = time.time()
+        stats = plugin.collect()
+        took = time.time() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] if tracemalloc is not None else None
+    if tracemalloc is not None:
+        tracemalloc.stop()
+    columns = sum(table.nbytes() for table in base.stats_parts(stats['openstack-nova'])
+            if isinstance(table, base.StatsTable))
+    print("plugin %8d metrics  %8s  read  %7.1f ms  (table columns %.1f MB)"
+            % (count_flat(plugin.flatten(stats)),
+            "%.1f MB" % (size / 1e6) if size is not None else 'n/a',
+            took * 1000, columns / 1e6))
+
+def main():
+    tenants = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    measure('dicts', make_dicts, tenants)
+    stats = measure('table', make_table, tenants)
+    print("table columns: %.1f MB" % (stats['openstack-nova'].nbytes() / 1e6))
+    plugin_run(tenants)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this module:
+#   asyncio fetch engine for the paginated list endpoints, used by
+#   Base.fetch_rows with 'AsyncFetch true'. Pages are requested as raw
+#   REST calls with the plugin's token, through the shared connection
+#   pool, and the next page is requested as soon as its link is known,
+#   while the items of the current one are reduced to tuples of the
+#   needed fields. All fetches run on one event loop, in its own thread.
+#   Several listings can be fetched at once, their pages handed over to
+#   the consumer as they arrive, interleaved, through one bounded queue:
+#   each listing has at most one page being fetched, one waiting for room
+#   in the queue and QUEUED in it, so memory stays bounded by PageSize
+#   times the number of listings, whatever their size.
+#
+#   This module needs python 3.5+ and is only imported when enabled, so
+#   the plugins still load on python 2.
+#
+import asyncio
+import queue
+import threading
+
+import base
+
+# pages waiting in the queue for the consumer, per listing
+QUEUED = 1
+
+_loop = None
+_lock = threading.Lock()
+
+class Unauthorized(Exception):
+    """The token was rejected."""
+    http_status = 401
+
+def get_loop():
+    """Returns the fetch event loop, starting its thread on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='openstack-fetch')
+            thread.daemon = True
+            thread.start()
+            _loop = loop
+        return _loop
+
+def next_link(body, collection, endpoint):
+    """Returns the url of the page after body, if any."""
+    url = base.next_link(body, collection)
+    if url is not None and url.startswith('/'):
+        # glance, relative to the endpoint
+        url = endpoint.rstrip('/') + url
+    return url
+
+def get_page(plugin, http, url, headers):
+    """Requests and decodes one page, in an executor thread."""
+    start = base.monotonic()
+    try:
+        resp = http.get(url, headers=headers)
+        if resp.status_code == 401:
+            raise Unauthorized("token rejected by %s" % url)
+        resp.raise_for_status()
+        body = resp.json()
+    except Exception:
+        plugin.record_call(base.monotonic() - start, True)
+        raise
+    plugin.record_call(base.monotonic() - start, False)
+    return body
+
+def put(pages, item, stopped):
+    """Puts item in pages once there is room, unless stopped first."""
+    while not stopped.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+async def fetch_pages(plugin, http, url, headers, endpoint, collection, fields,
+        listing, pages, stopped):
+    """
+    Puts (listing, rows) in pages for each page of the listing, then
+    (listing, None), or (listing, the exception which ended it). Waits
+    while pages is full, and gives up once the consumer is stopped.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        pending = loop.run_in_executor(None, get_page, plugin, http, url, headers)
+        while pending is not None:
+            body = await pending
+            url = next_link(body, collection, endpoint)
+            # prefetch the next page while this one is reduced to tuples
+            pending = None
+            if url is not None:
+                pending = loop.run_in_executor(None, get_page, plugin, http, url, headers)
+            rows = [tuple(item.get(field) for field in fields) for item in body[collection]]
+            body = None
+            if not await loop.run_in_executor(None, put, pages, (listing, rows), stopped):
+                return
+        result = None
+    except Exception as exc:
+        result = exc
+    await loop.run_in_executor(None, put, pages, (listing, result), stopped)
+
+def fetch_listings(plugin, endpoint, listings):
+    """
+    Starts fetching the given (path, collection, fields) listings at once,
+    and returns an iterator of (listing, row) over all of their items,
+    rows being tuples of the fields, in the order the pages arrive.
+    """
+    session = plugin.get_session()
+    headers = { 'X-Auth-Token': session.get_token(), 'Accept': 'application/json' }
+    http = base.http_pool.get(plugin.pool_size or max(10, plugin.concurrency,
+            2 * len(listings)))
+    pages = queue.Queue(QUEUED * len(listings))
+    stopped = threading.Event()
+    loop = get_loop()
+    for listing, (path, collection, fields) in enumerate(listings):
+        asyncio.run_coroutine_threadsafe(fetch_pages(plugin, http,
+                endpoint.rstrip('/') + path, headers, endpoint, collection, fields,
+                listing, pages, stopped), loop)
+    return iter_rows(pages, stopped, len(listings))
+
+def iter_rows(pages, stopped, listings):
+    """Yields (listing, row) from pages until all the listings ended."""
+    try:
+        while listings:
+            listing, rows = pages.get()
+            if rows is None:
+                listings -= 1
+                continue
+            if isinstance(rows, Exception):
+                raise rows
+            for row in rows:
+                yield listing, row
+    finally:
+        # ends the fetches still running when the consumer gives up
+        stopped.set()
@@ -26,14 +26,637 @@
 # collectd-python:
 #   http://collectd.org/documentation/manpages/collectd-python.5.shtml
 #
-from keystoneclient.v2_0 import Client as KeystoneClient
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 
+from array import array
+import bisect
 import collectd
-import datetime
+import collections
+import contextlib
+import copy
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import re
+import sys
+import threading
+import time
 import traceback
 
+Tenant = collections.namedtuple('Tenant', ('id', 'name'))
+
+# Catalog service types of the clients created with Base.get_client
+SERVICE_TYPES = {
+    'keystone': 'identity',
+    'keystone3': 'identity',
+    'nova': 'compute',
+    'cinder': 'volumev2',
+    'cinder3': 'volumev3',
+    'glance': 'image',
+    'neutron': 'network',
+}
+
+# Client classes by client name, imported on first use by client_class
+CLIENTS = {
+    'keystone': ('keystoneclient.v2_0', 'Client'),
+    'keystone3': ('keystoneclient.v3.client', 'Client'),
+    'nova': ('novaclient.client', 'Client'),
+    'cinder': ('cinderclient.client', 'Client'),
+    'glance': ('glanceclient.v2.client', 'Client'),
+    'neutron': ('neutronclient.neutron.client', 'Client'),
+}
+
+_loaded = {}
+
+def load(module, name):
+    """
+    Returns the attribute name of module, importing it on first use.
+
+    The client libraries are only imported by the plugins which get to
+    use them, so loading the plugins and reaching register_read stays
+    fast and light. Imports are shared by all plugins under 'Globals true'.
+    """
+    key = (module, name)
+    attr = _loaded.get(key)
+    if attr is None:
+        attr = _loaded[key] = getattr(importlib.import_module(module), name)
+    return attr
+
+def client_class(name):
+    """Returns the client class for a name of CLIENTS."""
+    return load(*CLIENTS[name])
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+# API version segment of an endpoint url path, e.g. v2.0 or v2.1
+VERSION = re.compile(r'^v\d+(\.\d+)?$')
+
+NAN = float('nan')
+
+class StatsTable(object):
+    """
+    Columnar stats of many plugin instances sharing the same metrics, e.g.
+    one row per tenant: each metric is an array('d') column indexed by row,
+    instead of a dict per instance and metric type. Missing values are NaN
+    and not dispatched.
+
+    Plugins return a StatsTable in place of the plugin instances dict of
+    their stats, or in a list with other tables and dicts, e.g.
+
+    {'plugin': [table, {'plugin_instance': {'type': {'type_instance': <value>}}}]}
+
+    Columns are named like flattened metrics, '<type>-<type_instance>'.
+    """
+
+    def __init__(self, columns=()):
+        self.rows = []
+        self.index = {}
+        self.names = []
+        self.columns = []
+        self.positions = {}
+        for name in columns:
+            self.column(name)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add_row(self, name):
+        """Adds a row of missing values, returning its position."""
+        row = self.index.get(name)
+        if row is None:
+            row = self.index[name] = len(self.rows)
+            self.rows.append(name)
+            for values in self.columns:
+                values.append(NAN)
+        return row
+
+    def copy_row(self, row, name):
+        """Adds a row with the values of another one."""
+        new = self.add_row(name)
+        for values in self.columns:
+            values[new] = values[row]
+        return new
+
+    def column(self, name):
+        """Returns the named column, adding it if missing."""
+        position = self.positions.get(name)
+        if position is None:
+            position = self.positions[name] = len(self.columns)
+            self.names.append(name)
+            self.columns.append(array('d', [NAN]) * len(self.rows))
+        return self.columns[position]
+
+    def set(self, row, name, value):
+        self.column(name)[row] = value
+
+    def update(self, row, values):
+        """Sets the values of a row from a dict of column name to value."""
+        for name, value in values.items():
+            self.column(name)[row] = value
+
+    def derive(self, name, func, *sources):
+        """
+        Computes a column from other ones in one pass, func being called with
+        the values of the sources on each row.
+        """
+        values = array('d', map(func, *[self.column(source) for source in sources]))
+        self.column(name)
+        self.columns[self.positions[name]] = values
+        return values
+
+    def prefixed(self, prefix):
+        """Returns the same table, sharing its columns, with prefixed rows."""
+        table = StatsTable()
+        table.rows = ["%s-%s" % (prefix, row) for row in self.rows]
+        table.index = dict((row, i) for i, row in enumerate(table.rows))
+        table.names = self.names
+        table.columns = self.columns
+        table.positions = self.positions
+        return table
+
+    def with_columns(self, columns):
+        """Returns the same table, sharing its rows, with other columns."""
+        table = StatsTable()
+        table.rows = self.rows
+        table.index = self.index
+        table.names = self.names
+        table.columns = columns
+        table.positions = self.positions
+        return table
+
+    def count(self):
+        """Returns the number of values, NaN excluded."""
+        # NaN is the only value not equal to itself
+        return sum(1 for values in self.columns for value in values if value == value)
+
+    def nbytes(self):
+        """Returns the size of the columns' values."""
+        return sum(values.itemsize * len(values) for values in self.columns)
+
+    def to_plain(self):
+        """Returns the table as plain lists, see from_plain."""
+        return { 'rows': self.rows, 'names': self.names,
+                 'columns': [list(values) for values in self.columns] }
+
+    @classmethod
+    def from_plain(cls, data):
+        """Rebuilds a table from the lists of to_plain."""
+        table = cls()
+        for name in data['rows']:
+            table.add_row(name)
+        for name, values in zip(data['names'], data['columns']):
+            if len(values) != len(table.rows):
+                raise ValueError("column %s has %d values for %d rows"
+                        % (name, len(values), len(table.rows)))
+            table.column(name)[:] = array('d', values)
+        return table
+
+def stats_parts(instances):
+    """Returns the dicts and StatsTables making the stats of a plugin."""
+    if isinstance(instances, list):
+        return instances
+    return [instances]
+
+def merge_stats(stats_list):
+    """
+    Merges stats dicts at the plugin instance level, without modifying them.
+    StatsTables are kept as they are, next to the merged dict.
+    """
+    merged = {}
+    tables = {}
+    for stats in stats_list:
+        for plugin, instances in stats.items():
+            merged_instances = merged.setdefault(plugin, {})
+            for part in stats_parts(instances):
+                if isinstance(part, StatsTable):
+                    tables.setdefault(plugin, []).append(part)
+                    continue
+                for plugin_instance, types in part.items():
+                    merged_types = merged_instances.get(plugin_instance)
+                    if merged_types is None:
+                        merged_instances[plugin_instance] = merged_types = {}
+                    merged_types.update(types)
+    for plugin, parts in tables.items():
+        merged[plugin] = [merged[plugin]] + parts
+    return merged
+
+def plain_stats(stats):
+    """
+    Returns stats as plain dicts and lists, their StatsTables included, to
+    be stored as json. load_stats rebuilds them.
+    """
+    def plain(instances):
+        if isinstance(instances, StatsTable):
+            return { 'table': instances.to_plain() }
+        if isinstance(instances, list):
+            return { 'parts': [plain(part) for part in instances] }
+        return { 'instances': instances }
+    return dict((plugin, plain(instances)) for plugin, instances in stats.items())
+
+def load_stats(data):
+    """Rebuilds the stats returned by plain_stats."""
+    def load(instances):
+        if 'table' in instances:
+            return StatsTable.from_plain(instances['table'])
+        if 'parts' in instances:
+            return [load(part) for part in instances['parts']]
+        return instances['instances']
+    return dict((plugin, load(instances)) for plugin, instances in data.items())
+
+def count_instances(stats):
+    """Returns the number of plugin instances in stats."""
+    return sum(len(part) for instances in stats.values() for part in stats_parts(instances))
+
+def prefix_stats(stats, prefix):
+    """Returns stats with prefix prepended to the plugin instances."""
+    prefixed = {}
+    for plugin, instances in stats.items():
+        parts = []
+        for part in stats_parts(instances):
+            if isinstance(part, StatsTable):
+                parts.append(part.prefixed(prefix))
+            else:
+                parts.append(dict(("%s-%s" % (prefix, instance), types)
+                        for instance, types in part.items()))
+        prefixed[plugin] = parts
+    return prefixed
+
+def to_bool(value):
+    """Parses a boolean config value, quoted or not."""
+    return value in (True, 'True', 'true')
+
+def http_status(exc):
+    """Returns the HTTP status carried by a client exception, if any."""
+    for attr in ('http_status', 'status_code', 'code'):
+        status = getattr(exc, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+def next_link(body, collection):
+    """
+    Returns the link to the page after body in a raw paged listing, if any:
+    the next one of '<collection>_links', or glance's 'next', which is
+    relative to the endpoint.
+    """
+    for link in body.get("%s_links" % collection) or ():
+        if link.get('rel') == 'next':
+            return link['href']
+    return body.get('next') or None
+
+class TenantCache(object):
+    """
+    Tenant lists shared by all the plugins loaded in one collectd process.
+
+    With 'Globals true' every plugin module imports this same module, so the
+    tenant list is fetched at most once per TTL for a given set of
+    credentials, however many plugins ask for it. Concurrent callers wait
+    for a single refresh instead of each issuing their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refreshing = {}
+
+    def _fresh(self, key, ttl):
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] < ttl:
+            return entry[1]
+        return None
+
+    def get(self, key, ttl, fetch):
+        """Returns the tenants cached under key, calling fetch() if stale."""
+        with self._lock:
+            tenants = self._fresh(key, ttl)
+            if tenants is not None:
+                return tenants
+            refresh_lock = self._refreshing.setdefault(key, threading.Lock())
+        with refresh_lock:
+            # another plugin may have refreshed it while we were waiting
+            with self._lock:
+                tenants = self._fresh(key, ttl)
+                if tenants is not None:
+                    return tenants
+                stale = self._entries.get(key)
+            try:
+                tenants = fetch()
+            except Exception:
+                if stale is None:
+                    raise
+                collectd.warning("failed to refresh tenant list, reusing one from %d seconds ago :: %s"
+                        % (time.time() - stale[0], traceback.format_exc()))
+                return stale[1]
+            with self._lock:
+                self._entries[key] = (time.time(), tenants)
+            return tenants
+
+    def peek(self, key):
+        """Returns the (timestamp, tenants) cached under key, or None."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def seed(self, key, timestamp, tenants):
+        """Caches tenants fetched at timestamp, unless newer ones are cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < timestamp:
+                self._entries[key] = (timestamp, tenants)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+tenant_cache = TenantCache()
+
+class CircuitBreaker(object):
+    """
+    Tracks the health of an endpoint, opening after threshold consecutive
+    failures (errors, 5xx responses, or responses slower than slow seconds).
+    While open requests fail immediately, until a single probe request is
+    let through after backoff seconds; each failed probe doubles the wait,
+    up to max_backoff.
+    """
+
+    max_backoff = 600.0
+
+    def __init__(self, name, threshold=5, slow=None, backoff=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.slow = slow
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._delay = backoff
+        self._probing = False
+
+    def configure(self, threshold, slow, backoff):
+        """Updates the settings, keeping the current state."""
+        with self._lock:
+            self.threshold = threshold
+            self.slow = slow
+            self.backoff = backoff
+            if self._opened is None:
+                self._delay = backoff
+
+    def allow(self):
+        """Returns whether a request may be sent now."""
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._probing or monotonic() - self._opened < self._delay:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok):
+        """Records the outcome of a request allowed through."""
+        with self._lock:
+            if ok:
+                if self._opened is not None:
+                    collectd.info("circuit closed for %s" % self.name)
+                self._failures = 0
+                self._opened = None
+                self._delay = self.backoff
+                self._probing = False
+                return
+            self._failures += 1
+            if self._probing:
+                self._probing = False
+                self._delay = min(self._delay * 2, self.max_backoff)
+                self._opened = monotonic()
+            elif self._opened is None and self.threshold and self._failures >= self.threshold:
+                collectd.warning("circuit opened for %s after %d failures, retrying in %d seconds"
+                        % (self.name, self._failures, self._delay))
+                self._opened = monotonic()
+
+def http_classes():
+    """
+    Returns the (CircuitOpen, EndpointAdapter) classes. They derive from
+    requests classes, so they are only defined on first use, along with
+    the import of requests, which takes most of the time to import this
+    module. Called with the HTTPPool lock held.
+    """
+    classes = _loaded.get('http_classes')
+    if classes is None:
+        from requests.adapters import HTTPAdapter
+        import requests
+
+        class CircuitOpen(requests.exceptions.ConnectionError):
+            """Raised instead of sending requests to an endpoint whose breaker is open."""
+
+        class EndpointAdapter(HTTPAdapter):
+            """
+            An HTTPAdapter applying a default (connect, read) timeout and a circuit
+            breaker to the requests it sends.
+            """
+
+            def __init__(self, name, timeout=None, breaker=None, **kwargs):
+                self.timeout = timeout
+                self.breaker = breaker or CircuitBreaker(name, threshold=0)
+                HTTPAdapter.__init__(self, **kwargs)
+
+            def send(self, request, **kwargs):
+                if kwargs.get('timeout') is None:
+                    kwargs['timeout'] = self.timeout
+                breaker = self.breaker
+                if not breaker.allow():
+                    raise CircuitOpen("circuit open for %s" % breaker.name, request=request)
+                start = monotonic()
+                try:
+                    response = HTTPAdapter.send(self, request, **kwargs)
+                except Exception:
+                    breaker.record(False)
+                    raise
+                slow = breaker.slow and monotonic() - start > breaker.slow
+                breaker.record(response.status_code < 500 and not slow)
+                return response
+
+        classes = _loaded['http_classes'] = (CircuitOpen, EndpointAdapter)
+    return classes
+
+class HTTPPool(object):
+    """
+    A keep-alive, connection pooling requests.Session shared by the clients
+    of all the plugins loaded in one collectd process, so connections to
+    the API endpoints are reused across clients, plugins and reads.
+
+    Each API endpoint gets its own adapter, holding its timeouts and
+    circuit breaker, mounted on the root of the endpoint: its url up to the
+    API version, so services sharing a host under different paths (e.g.
+    http://host/compute/v2.1 and http://host/volume/v2) are kept apart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._adapters = {}
+        self.size = 0
+
+    def _mount(self, prefix, timeout=None, breaker=None):
+        adapter = http_classes()[1](prefix, timeout, breaker,
+                pool_connections=self.size, pool_maxsize=self.size)
+        self._session.mount(prefix, adapter)
+        self._adapters[prefix] = adapter
+        return adapter
+
+    def get(self, size):
+        """Returns the shared session, with room for at least size connections per host."""
+        with self._lock:
+            if self._session is None:
+                self._session = load('requests', 'Session')()
+            if size > self.size:
+                # connections pooled by the replaced adapters are released as
+                # the requests holding them complete
+                self.size = size
+                for prefix in ('http://', 'https://'):
+                    self._mount(prefix)
+                for prefix, adapter in list(self._adapters.items()):
+                    if prefix not in ('http://', 'https://'):
+                        self._mount(prefix, adapter.timeout, adapter.breaker)
+            return self._session
+
+    @staticmethod
+    def root(url):
+        """Returns the root of an endpoint url, the part before the API version."""
+        parts = urlparse(url)
+        path = []
+        for segment in parts.path.split('/'):
+            if not segment:
+                continue
+            if VERSION.match(segment):
+                break
+            path.append(segment)
+        return "%s://%s/%s" % (parts.scheme, parts.netloc,
+                ''.join("%s/" % segment for segment in path))
+
+    def endpoint(self, url, timeout=None, threshold=0, slow=None, backoff=30.0):
+        """
+        Sets the timeout and circuit breaker settings for requests to the
+        endpoint of url, keeping its breaker state if it already had one.
+        """
+        prefix = self.root(url)
+        with self._lock:
+            adapter = self._adapters.get(prefix)
+            if adapter is None:
+                adapter = self._mount(prefix, breaker=CircuitBreaker(prefix,
+                        threshold, slow, backoff))
+            adapter.timeout = timeout
+            adapter.breaker.configure(threshold, slow, backoff)
+
+    def stats(self):
+        """Returns (host, requests, connections opened) for each pooled host."""
+        stats = []
+        for adapter in list(self._adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    stats.append(("%s:%s" % (pool.host, pool.port),
+                            pool.num_requests, pool.num_connections))
+        return stats
+
+http_pool = HTTPPool()
+
+class HashRing(object):
+    """
+    Consistent hash ring assigning keys to peers, so adding or removing a
+    peer only moves the keys of its neighbours on the ring.
+    """
+
+    replicas = 100
+
+    def __init__(self, peers):
+        ring = sorted((self.hash("%s-%d" % (peer, i)), peer)
+                for peer in peers for i in range(self.replicas))
+        self._hashes = [point[0] for point in ring]
+        self._peers = [point[1] for point in ring]
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        """Returns the peer key is assigned to."""
+        i = bisect.bisect(self._hashes, self.hash(key)) % len(self._hashes)
+        return self._peers[i]
+
+class ResourceIndex(object):
+    """
+    Index of resource id to (group, size), keeping running count and size
+    totals per group so incremental listings only adjust them by what
+    changed. Groups are whatever resources are accounted by, e.g. their
+    owner, or a (tenant, volume type, backend) tuple.
+    """
+
+    # statuses of resources which are gone, or about to be
+    deleted = ('deleted', 'pending_delete', 'killed')
+
+    def __init__(self, scans=0):
+        self.resources = {}
+        self.totals = {}
+        self.marker = None
+        self.scans = scans
+
+    def add(self, id, group, size, status=None):
+        self.discard(id)
+        if status in self.deleted:
+            return
+        self.resources[id] = (group, size)
+        totals = self.totals.get(group)
+        if totals is None:
+            totals = self.totals[group] = [0, 0]
+        totals[0] += 1
+        totals[1] += size
+
+    def discard(self, id):
+        entry = self.resources.pop(id, None)
+        if entry is None:
+            return
+        totals = self.totals[entry[0]]
+        totals[0] -= 1
+        totals[1] -= entry[1]
+        if not totals[0]:
+            del self.totals[entry[0]]
+
+# keystone (auth, Session, lock) per set of credentials, shared by plugins
+sessions = {}
+sessions_lock = threading.Lock()
+
+# Set by the openstack_plugin module while it imports the service plugin
+# modules for their classes, so they don't register their own callbacks
+embedded = False
+# Names of the service plugin modules loaded on their own, and whether the
+# openstack_plugin module is loaded, to warn when both are
+standalone = set()
+unified = False
+
+def register_module(name, register):
+    """
+    Calls register, which creates the plugin of a service plugin module and
+    registers its callbacks with collectd, unless the module is imported by
+    openstack_plugin for its class only.
+    """
+    if embedded:
+        return
+    if unified:
+        collectd.warning("%s is loaded next to openstack_plugin, a service configured in "
+                "both is collected twice" % name)
+    standalone.add(name)
+    register()
+
 class Base(object):
 
+    # Names of the collection groups, if the plugin splits its collection
+    # in groups run at their own interval; see get_stats
+    groups = ()
+
     def __init__(self):
         self.username = 'admin'
         self.password = '123456'
@@ -45,16 +668,403 @@ class Base(object):
         self.interval = 60.0
         self.notenants = False
         self.region = None
+        self.regions = []
+        self.token_refresh = 300.0
+        self.tenant_cache_ttl = 300.0
+        self.concurrency = 1
+        self.pool_size = None
+        self.timeouts = {}
+        self.breaker_threshold = 5
+        self.breaker_slow = None
+        self.breaker_backoff = 30.0
+        self.bulk = False
+        self.page_size = 1000
+        self.background = False
+        self.max_age = None
+        self.delta = False
+        self.full_refresh = 10
+        self.group_intervals = {}
+        self.shard_peers = []
+        self.shard_name = None
+        self.state_dir = None
+        self.state_max_age = 3600.0
+        self.incremental = False
+        self.volume_usage = False
+        self.server_usage = False
+        self.async_fetch = False
+        self.flavor_cache_ttl = 3600.0
+        self.reconcile = 10
+        self.aggregate_metadata = []
+        self._auth = None
+        self._auth_lock = None
+        self._session = None
+        self._clients = {}
+        self._pool = None
+        self._worker = None
+        self._snapshot = None
+        self.collected_at = None
+        self._stopping = threading.Event()
+        self._values = None
+        self._dispatches = 0
+        self._last_sent = {}
+        self._last_good = {}
+        self._ring = None
+        self._warm_loaded = False
+        self._shard_source = None
+        self._shard_tenants = None
+        self._health_lock = threading.Lock()
+        self._health = self.new_health()
+        self._last_health = None
+        self._dispatched = (0, 0.0)
+        self._group_stats = {}
+        self._group_times = {}
+        self._group_interval = 0
+        self._indexes = {}
+        self._last_stats = None
+        self._region_collectors = None
+        self._region_pool = None
+
+    def get_session(self):
+        """
+        Returns the keystone Session shared by all clients of the plugins
+        using the same credentials.
+
+        The token and service catalog are kept across reads, and refreshed
+        once they are within token_refresh seconds of expiring.
+        """
+        if self._session is None:
+            http = http_pool.get(self.pool_size or max(10, self.concurrency))
+            key = (self.auth_url, self.username, self.password, self.tenant)
+            with sessions_lock:
+                if key not in sessions:
+                    auth = load('keystoneclient.auth.identity.v2', 'Password')(auth_url=self.auth_url,
+                            username=self.username, password=self.password,
+                            tenant_name=self.tenant)
+                    session = load('keystoneclient.session', 'Session')
+                    sessions[key] = (auth, session(auth=auth, session=http),
+                            threading.Lock())
+                self._auth, self._session, self._auth_lock = sessions[key]
+            self.setup_endpoint(self.auth_url, 'identity')
+        with self._auth_lock:
+            auth_ref = self._auth.auth_ref
+            if auth_ref is None or auth_ref.will_expire_soon(self.token_refresh):
+                if auth_ref is not None:
+                    self.logverbose("token expires at %s, refreshing" % auth_ref.expires)
+                with self.timed('auth'):
+                    self._auth.invalidate()
+                    self._auth.get_access(self._session)
+        return self._session
+
+    def invalidate(self):
+        """Drops the cached token, forcing a new authentication."""
+        if self._auth is not None:
+            self._auth.invalidate()
+
+    def get_client(self, name, factory):
+        """
+        Returns the cached client for the given service, creating it on
+        first use with factory(session).
+        """
+        session = self.get_session()
+        client = self._clients.get(name)
+        if client is None:
+            service_type = SERVICE_TYPES.get(name)
+            if service_type is not None:
+                for interface in ('public', 'admin'):
+                    try:
+                        url = session.get_endpoint(service_type=service_type,
+                                interface=interface, region_name=self.region)
+                    except Exception:
+                        url = None
+                    if url:
+                        self.setup_endpoint(url, service_type)
+            client = factory(session)
+            self._clients[name] = client
+        return client
+
+    def setup_endpoint(self, url, service_type):
+        """Applies the configured timeouts and circuit breaker to url's host."""
+        timeout = self.timeouts.get(service_type, self.timeouts.get(None))
+        http_pool.endpoint(url, timeout, self.breaker_threshold,
+                self.breaker_slow, self.breaker_backoff)
+
+    def get_endpoint(self, service_type, interface='public'):
+        """Returns the endpoint for service_type from the catalog."""
+        return self.get_session().get_endpoint(service_type=service_type,
+                interface=interface, region_name=self.region)
 
     def get_keystone(self):
         """Returns a Keystone.Client instance."""
-        if self.region is None:
-            return KeystoneClient(username=self.username, password=self.password,
-                                  tenant_name=self.tenant, auth_url=self.auth_url)
+        return self.get_client('keystone', lambda session:
+                client_class('keystone')(session=session, region_name=self.region))
+
+    def get_all_tenants(self):
+        """Returns the list of Tenant(id, name), shared between plugins."""
+        key = (self.auth_url, self.username, self.tenant)
+        with self.timed('tenants'):
+            return tenant_cache.get(key, self.tenant_cache_ttl, self._fetch_tenants)
+
+    def get_tenants(self):
+        """Returns the tenants this collector's shard is in charge of."""
+        tenants = self.get_all_tenants()
+        if not self.shard_peers:
+            return tenants
+        if tenants is not self._shard_source:
+            if self._ring is None:
+                self._ring = HashRing(self.shard_peers)
+            ring = self._ring
+            self._shard_tenants = [tenant for tenant in tenants
+                    if ring.get(tenant.id) == self.shard_name]
+            self._shard_source = tenants
+            self.logverbose("collecting %d out of %d tenants as shard %s"
+                    % (len(self._shard_tenants), len(tenants), self.shard_name))
+        return self._shard_tenants
+
+    def is_primary(self):
+        """
+        Returns whether this collector reports the cluster wide series, which
+        only the first shard does.
+        """
+        return not self.shard_peers or self.shard_name == self.shard_peers[0]
+
+    def _fetch_tenants(self):
+        if self.async_fetch:
+            tenants = [Tenant(*row) for row in self.fetch_rows('identity', '/tenants',
+                    'tenants', ('id', 'name'), interface='admin')]
+        else:
+            keystone = self.get_keystone()
+            tenants = [Tenant(t.id, t.name) for t in self.call_api(keystone.tenants.list)]
+        self.logverbose("fetched %d tenants from keystone" % len(tenants))
+        return tenants
+
+    def map_tenants(self, func, fill, tenants, table=None):
+        """
+        Calls func(tenant) for every tenant, using up to Concurrency threads,
+        and fill(table, row, result) with each result, on this thread, to
+        set the tenant's row in a StatsTable (a new one unless given), which
+        is returned. Results are not kept once they are in the table.
+
+        When the call fails for a tenant, e.g. while a circuit breaker is
+        open, its row is copied from the table of the last successful call,
+        and its age reported in the collector.stale metrics, unless it is
+        overdue by more than stale_max_age (see get_stats). Tenants which
+        never succeeded have no row, unless the given table had one.
+        """
+        def call(tenant):
+            try:
+                return tenant, func(tenant), None
+            except Exception as exc:
+                return tenant, None, exc
+
+        if self.concurrency > 1:
+            if self._pool is None:
+                self._pool = load('multiprocessing.pool', 'ThreadPool')(self.concurrency)
+            results = self._pool.imap_unordered(call, tenants)
+        else:
+            results = (call(tenant) for tenant in tenants)
+
+        if table is None:
+            table = StatsTable()
+        # time each row was last successfully fetched, by row
+        fetched = array('d')
+        previous, previous_fetched = self._last_good.get(func.__name__, (None, None))
+        failed = []
+        now = time.time()
+        max_age = self.stale_max_age() + self._group_interval
+        for tenant, result, exc in results:
+            name = "tenant-%s" % tenant.name
+            if exc is None:
+                row = table.add_row(name)
+                fill(table, row, result)
+                timestamp = now
+            else:
+                failed.append((tenant, exc))
+                previous_row = previous.index.get(name) if previous is not None else None
+                if previous_row is None or previous_row >= len(previous_fetched):
+                    continue
+                timestamp = previous_fetched[previous_row]
+                if timestamp != timestamp:
+                    # a row the caller set up, never fetched
+                    continue
+                if now - timestamp > max_age:
+                    continue
+                row = table.add_row(name)
+                for column, values in zip(previous.names, previous.columns):
+                    table.set(row, column, values[previous_row])
+                self.record_stale(now - timestamp)
+            if len(fetched) <= row:
+                fetched.extend([NAN] * (row + 1 - len(fetched)))
+            fetched[row] = timestamp
+        self._last_good[func.__name__] = (table, fetched)
+
+        if failed:
+            tenant, exc = failed[0]
+            collectd.error("%s: failed to get stats for %d tenants, using last known values "
+                    "where available :: %s :: %s" % (self.prefix, len(failed), tenant.name, exc))
+            for tenant, exc in failed[1:]:
+                self.logverbose("failed to get stats for tenant %s :: %s" % (tenant.name, exc))
+        return table
+
+    def call_api(self, func, *args, **kwargs):
+        """Calls func, re-authenticating once if the token is rejected."""
+        try:
+            return self.timed_call(func, *args, **kwargs)
+        except Exception as exc:
+            if http_status(exc) != 401:
+                raise
+            self.logverbose("token rejected, re-authenticating :: %s" % exc)
+            self.invalidate()
+            return self.timed_call(func, *args, **kwargs)
+
+    def list_raw(self, get, url, collection):
+        """
+        Yields the raw items of a paged listing, page by page, get(url)
+        being a client's raw request returning (resp, body), e.g.
+        client.client.get, called through call_api for each page. Pages
+        follow each other by their next links, see next_link.
+        """
+        while url:
+            resp, body = self.call_api(get, url)
+            for item in body[collection]:
+                yield item
+            url = next_link(body, collection)
+
+    def fetch_rows(self, service_type, path, collection, fields, interface='public'):
+        """
+        Yields the items of a paginated listing as tuples of the given
+        fields, page by page, using the asyncio fetch engine (see
+        asyncfetch), which requests the next page while the current one is
+        processed.
+
+        path is relative to the service endpoint, e.g. '/v2.0/ports?limit=100'
+        for the network service, and collection the key of the items in the
+        responses.
+        """
+        for listing, row in self.fetch_listings(service_type,
+                [(path, collection, fields)], interface):
+            yield row
+
+    def fetch_listings(self, service_type, listings, interface='public'):
+        """
+        Like fetch_rows for several (path, collection, fields) listings of
+        one service, fetched at once: yields (listing, row), listing being
+        the position of the row's listing, as their pages arrive. A rejected
+        token is renewed and the listings retried if nothing was yielded yet.
+        """
+        fetch = load('asyncfetch', 'fetch_listings')
+        endpoint = self.get_endpoint(service_type, interface)
+        self.setup_endpoint(endpoint, service_type)
+        rows = fetch(self, endpoint, listings)
+        try:
+            first = next(rows, None)
+        except Exception as exc:
+            if http_status(exc) != 401:
+                raise
+            self.logverbose("token rejected, re-authenticating :: %s" % exc)
+            self.invalidate()
+            rows = fetch(self, endpoint, listings)
+            first = next(rows, None)
+        if first is None:
+            return
+        yield first
+        for row in rows:
+            yield row
+
+    def timed_call(self, func, *args, **kwargs):
+        """Calls func, accounting it as an API request."""
+        start = monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_call(monotonic() - start, True)
+            raise
+        self.record_call(monotonic() - start, False)
+        return result
+
+    def iter_pages(self, pages):
+        """
+        Iterates over pages a client fetches lazily, accounting each page as
+        an API request.
+        """
+        pages = iter(pages)
+        while True:
+            start = monotonic()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            except Exception:
+                self.record_call(monotonic() - start, True)
+                raise
+            self.record_call(monotonic() - start, False)
+            yield page
+
+    def update_index(self, name, scan):
+        """
+        Brings the named ResourceIndex up to date and returns it.
+
+        scan(since) yields (id, group, size, status, updated_at) for
+        the resources updated at or after since, or for all of them when
+        since is None. Listings only return what still exists, so every
+        Reconcile scans the index is rebuilt from a full listing to drop
+        the resources deleted in between.
+        """
+        index = self._indexes.get(name)
+        if index is None or index.marker is None or index.scans % self.reconcile == 0:
+            index = ResourceIndex(index.scans if index is not None else 0)
+            since = None
         else:
-            return KeystoneClient(username=self.username, password=self.password,
-                                  tenant_name=self.tenant, auth_url=self.auth_url,
-                                  region_name=self.region)
+            since = index.marker
+        # the high-water mark only moves once the whole scan went through,
+        # so a page failing half way doesn't skip the changes after it
+        marker = index.marker
+        updates = 0
+        try:
+            for id, group, size, status, updated_at in scan(since):
+                index.add(id, group, size, status)
+                if updated_at and (marker is None or updated_at > marker):
+                    marker = updated_at
+                updates += 1
+        except Exception:
+            # the updates already applied leave the index half way, have the
+            # next scan rebuild it
+            index.marker = None
+            raise
+        index.marker = marker
+        index.scans += 1
+        self._indexes[name] = index
+        self.logverbose("%s index: %d updates since %s, %d resources"
+                % (name, updates, since or 'ever', len(index.resources)))
+        return index
+
+    def record_call(self, duration, failed):
+        with self._health_lock:
+            health = self._health
+            health['requests'] += 1
+            if failed:
+                health['failures'] += 1
+            health['time']['api'] = health['time'].get('api', 0.0) + duration
+
+    def record_stale(self, age, count=1):
+        with self._health_lock:
+            health = self._health
+            health['stale'] += count
+            health['stale_age'] = max(health['stale_age'], age)
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        """Accounts the time spent in the block to the given phase."""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            duration = monotonic() - start
+            with self._health_lock:
+                times = self._health['time']
+                times[phase] = times.get(phase, 0.0) + duration
+
+    def new_health(self):
+        return { 'time': {}, 'requests': 0, 'failures': 0, 'stale': 0, 'stale_age': 0.0 }
 
     def config_callback(self, conf):
         """Takes a collectd conf object and fills in the local config."""
@@ -85,6 +1095,8 @@ class Base(object):
                 self.ReservedCores = float(node.values[0] or 0)
             elif node.key == "ReservedRamMB":
                 self.ReservedRamMB = float(node.values[0] or 0)
+            elif node.key == "AggregateMetadata":
+                self.aggregate_metadata.append((node.values[0], node.values[1]))
             elif node.key == "Prefix":
                 self.prefix = node.values[0]
             elif node.key == 'Interval':
@@ -92,9 +1104,92 @@ class Base(object):
             elif node.key == 'NoTenants':
                 self.notenants = True
             elif node.key == 'Region':
-                self.region = node.values[0]
+                self.regions = list(node.values)
+                self.region = self.regions[0]
+            elif node.key == 'TokenRefresh':
+                self.token_refresh = float(node.values[0])
+            elif node.key == 'Concurrency':
+                self.concurrency = max(1, int(node.values[0]))
+            elif node.key == 'PoolSize':
+                self.pool_size = int(node.values[0])
+            elif node.key == 'Timeout':
+                # Timeout [service] connect [read]
+                values = list(node.values)
+                services = [None]
+                if isinstance(values[0], str) and not values[0].replace('.', '', 1).isdigit():
+                    service = values.pop(0)
+                    # the v3 clients (keystone3, cinder3) share the service's timeouts
+                    services = [SERVICE_TYPES[name] for name in (service, service + '3')
+                            if name in SERVICE_TYPES] or [service]
+                connect = float(values[0])
+                read = float(values[1]) if len(values) > 1 else connect
+                for service in services:
+                    self.timeouts[service] = (connect, read)
+            elif node.key == 'BreakerThreshold':
+                self.breaker_threshold = int(node.values[0])
+            elif node.key == 'BreakerSlow':
+                self.breaker_slow = float(node.values[0])
+            elif node.key == 'BreakerBackoff':
+                self.breaker_backoff = float(node.values[0])
+            elif node.key == 'ShardCount':
+                self.shard_peers = ["shard-%d" % i for i in range(int(node.values[0]))]
+            elif node.key == 'ShardIndex':
+                self.shard_name = "shard-%d" % int(node.values[0])
+            elif node.key == 'ShardPeers':
+                self.shard_peers = list(node.values)
+            elif node.key == 'ShardName':
+                self.shard_name = node.values[0]
+            elif node.key == 'StateDir':
+                self.state_dir = node.values[0]
+            elif node.key == 'StateMaxAge':
+                self.state_max_age = float(node.values[0])
+            elif node.key == 'Bulk':
+                self.bulk = to_bool(node.values[0])
+            elif node.key == 'PageSize':
+                self.page_size = int(node.values[0])
+            elif node.key == 'Incremental':
+                self.incremental = to_bool(node.values[0])
+            elif node.key == 'AsyncFetch':
+                self.async_fetch = to_bool(node.values[0])
+                if self.async_fetch and sys.version_info < (3, 5):
+                    collectd.warning("%s: AsyncFetch needs python 3.5+, ignored" % self.prefix)
+                    self.async_fetch = False
+            elif node.key == 'ServerUsage':
+                self.server_usage = to_bool(node.values[0])
+            elif node.key == 'FlavorCacheTTL':
+                self.flavor_cache_ttl = float(node.values[0])
+            elif node.key == 'VolumeUsage':
+                self.volume_usage = to_bool(node.values[0])
+            elif node.key == 'Reconcile':
+                self.reconcile = max(1, int(node.values[0]))
+            elif node.key == 'Background':
+                self.background = to_bool(node.values[0])
+            elif node.key == 'MaxAge':
+                self.max_age = float(node.values[0])
+            elif node.key == 'DeltaDispatch':
+                self.delta = to_bool(node.values[0])
+            elif node.key == 'FullRefresh':
+                self.full_refresh = max(1, int(node.values[0]))
+            elif node.key == 'GroupInterval':
+                self.group_intervals[node.values[0]] = float(node.values[1])
+            elif node.key == 'TenantCacheTTL':
+                self.tenant_cache_ttl = float(node.values[0])
             else:
                 collectd.warning("%s: unknown config key: %s" % (self.prefix, node.key))
+        self.check_shard()
+
+    def check_shard(self):
+        """Logs an error when this node is given no shard of the tenants."""
+        if self.shard_peers and self.shard_name not in self.shard_peers:
+            if self.shard_name is None:
+                problem = "no ShardIndex or ShardName is set"
+            else:
+                problem = "%s is not one of %s" % (self.shard_name, ", ".join(self.shard_peers))
+            collectd.error("%s: sharding is configured but %s, no tenant will be collected"
+                    % (self.prefix, problem))
+        elif self.shard_name is not None and not self.shard_peers:
+            collectd.warning("%s: %s is set without ShardCount or ShardPeers, ignored"
+                    % (self.prefix, self.shard_name))
 
     def dispatch(self, stats):
         """
@@ -104,58 +1199,527 @@ class Base(object):
 
         {'plugin': {'plugin_instance': {'type': {'type_instance': <value>, ...}}}}
         """
+        self._dispatched = (0, 0.0)
         if not stats:
             collectd.error("%s: failed to retrieve stats" % self.prefix)
             return
 
-        self.logdebug("dispatching %d new stats :: %s" % (len(stats), stats))
+        if self.debug:
+            self.logdebug("dispatching %d new stats :: %s" % (len(stats), stats))
+        start = monotonic()
         try:
-            for plugin in stats.keys():
-                for plugin_instance in stats[plugin].keys():
-                    for type in stats[plugin][plugin_instance].keys():
-                        type_value = stats[plugin][plugin_instance][type]
-                        if not isinstance(type_value, dict):
-                            self.dispatch_value(plugin, plugin_instance, type, None, type_value)
-                        else:
-                          for type_instance in stats[plugin][plugin_instance][type].keys():
-                                self.dispatch_value(plugin, plugin_instance,
-                                        type, type_instance,
-                                        stats[plugin][plugin_instance][type][type_instance])
+            flat = self.flatten(stats)
+            if self.delta:
+                flat, sent = self.changed(flat)
+            self._dispatched = (self.dispatch_flat(flat), monotonic() - start)
+            if self.delta:
+                self.record_sent(*sent)
         except Exception as exc:
             collectd.error("%s: failed to dispatch values :: %s :: %s"
                     % (self.prefix, exc, traceback.format_exc()))
 
-    def dispatch_value(self, plugin, plugin_instance, type, type_instance, value):
-        """Looks for the given stat in stats, and dispatches it"""
-        self.logdebug("dispatching value %s.%s.%s.%s=%s"
-                % (plugin, plugin_instance, type, type_instance, value))
+    def dispatch_health(self):
+        """
+        Dispatches the plugin's own health metrics under <prefix>.collector:
+        the duration of the last collection and of each of its phases, the
+        API requests it made and how many failed, the number of tenant
+        results reused from previous collections and the oldest one's age,
+        and the number of metrics dispatched, along with how long
+        dispatching them took.
+        """
+        health = self._last_health
+        if health is None:
+            return
+        metrics, took = self._dispatched
+        times = dict(health['time'], dispatch=took)
+        collector = { 'duration': health['duration'], 'time': times,
+                'requests': health['requests'], 'failures': health['failures'],
+                'stale': health['stale'], 'stale_age': health['stale_age'],
+                'metrics': metrics }
+        try:
+            self.dispatch_flat(self.flatten({ self.prefix: { 'collector': collector } }))
+        except Exception as exc:
+            collectd.error("%s: failed to dispatch health values :: %s :: %s"
+                    % (self.prefix, exc, traceback.format_exc()))
+
+    def flatten(self, stats):
+        """
+        Flattens stats in a single pass into a list of
+
+        (plugin, [(plugin_instance, type_instance, value), ...], [StatsTable, ...])
+
+        Only the dicts are flattened, the tables are kept as they are and
+        walked column by column on dispatch, without a tuple per value.
+        """
+        flat = []
+        for plugin, instances in stats.items():
+            metrics = []
+            tables = []
+            append = metrics.append
+            for part in stats_parts(instances):
+                if isinstance(part, StatsTable):
+                    tables.append(part)
+                    continue
+                for plugin_instance, types in part.items():
+                    for type, type_value in types.items():
+                        if not isinstance(type_value, dict):
+                            append((plugin_instance, type, type_value))
+                        else:
+                            for type_instance, value in type_value.items():
+                                append((plugin_instance,
+                                        "%s-%s" % (type, type_instance), value))
+            flat.append((plugin, metrics, tables))
+        return flat
+
+    def changed(self, flat):
+        """
+        Filters flattened stats down to the values that changed since they
+        were last sent, except every FullRefresh dispatches when everything
+        is sent again so series don't go stale in the backend.
+
+        Last sent values are kept as floats by the hash of the plugin
+        instance, in a dict per plugin and type instance, i.e. per table
+        column, rather than by the identifier strings themselves. Tables are
+        filtered column by column, into columns where the unchanged values
+        are NaN. Values are only recorded once dispatched, see record_sent:
+        returns the changed stats and the (full, values) to record.
+        """
+        full = self._dispatches % self.full_refresh == 0
+        last_sent = self._last_sent
+        changed = []
+        # {hash of (plugin, type_instance): {hash of plugin_instance: value}}
+        sent = {}
+        total = 0
+        for plugin, metrics, tables in flat:
+            keep = []
+            for metric in metrics:
+                key = hash((plugin, metric[1]))
+                instance = hash(metric[0])
+                value = float(metric[2])
+                if full or last_sent.get(key, {}).get(instance) != value:
+                    updates = sent.get(key)
+                    if updates is None:
+                        updates = sent[key] = {}
+                    updates[instance] = value
+                    keep.append(metric)
+            total += len(metrics)
+            kept_tables = []
+            for table in tables:
+                hashes = [hash(row) for row in table.rows]
+                columns = []
+                for name, values in zip(table.names, table.columns):
+                    key = hash((plugin, name))
+                    last = {} if full else last_sent.get(key, {})
+                    column = values if full else array('d', [NAN]) * len(values)
+                    updates = sent.get(key)
+                    if updates is None:
+                        updates = sent[key] = {}
+                    for row, value in enumerate(values):
+                        # NaN is the only value not equal to itself
+                        if value != value:
+                            continue
+                        total += 1
+                        instance = hashes[row]
+                        if full or last.get(instance) != value:
+                            updates[instance] = value
+                            column[row] = value
+                    columns.append(column)
+                kept_tables.append(table if full else table.with_columns(columns))
+            changed.append((plugin, keep, kept_tables))
+        self.logverbose("dispatching %d changed metrics out of %d%s"
+                % (sum(len(updates) for updates in sent.values()), total,
+                ' (full refresh)' if full else ''))
+        return changed, (full, sent)
+
+    def record_sent(self, full, values):
+        """
+        Records the values dispatched from changed. A full refresh replaces
+        them all, dropping the metrics which are gone, e.g. of deleted
+        tenants.
+        """
+        if full:
+            self._last_sent = values
+        else:
+            last_sent = self._last_sent
+            for key, updates in values.items():
+                if key in last_sent:
+                    last_sent[key].update(updates)
+                else:
+                    last_sent[key] = updates
+        self._dispatches += 1
 
-        val = collectd.Values(type='gauge')
-        val.plugin=plugin
-        val.plugin_instance=plugin_instance
+    def dispatch_flat(self, flat):
+        """
+        Dispatches flattened stats, reusing a single collectd.Values and
+        its values list, which collectd reads on each dispatch. Tables are
+        walked column by column, skipping NaN. Returns the number of values
+        dispatched.
+        """
+        val = self.get_values()
+        dispatch = val.dispatch
+        debug = self.debug
+        current = [0.0]
+        val.values = current
+        count = 0
+        for plugin, metrics, tables in flat:
+            val.plugin = plugin
+            for plugin_instance, type_instance, value in metrics:
+                val.plugin_instance = plugin_instance
+                val.type_instance = type_instance
+                current[0] = value
+                dispatch()
+                if debug:
+                    self.logdebug("sent metric %s.%s.%s.%s"
+                            % (plugin, plugin_instance, type_instance, value))
+            count += len(metrics)
+            for table in tables:
+                rows = table.rows
+                for type_instance, values in zip(table.names, table.columns):
+                    val.type_instance = type_instance
+                    for plugin_instance, value in zip(rows, values):
+                        # NaN is the only value not equal to itself
+                        if value != value:
+                            continue
+                        val.plugin_instance = plugin_instance
+                        current[0] = value
+                        dispatch()
+                        count += 1
+                        if debug:
+                            self.logdebug("sent metric %s.%s.%s.%s"
+                                    % (plugin, plugin_instance, type_instance, value))
+        return count
+
+    def get_values(self):
+        """Returns the collectd.Values template all metrics are sent with."""
+        if self._values is None:
+            self._values = collectd.Values(type='gauge')
+        self._values.interval = self.interval
+        return self._values
+
+    def dispatch_value(self, plugin, plugin_instance, type, type_instance, value):
+        """Dispatches a single value"""
         if type_instance is not None:
-            val.type_instance="%s-%s" % (type, type_instance)
+            type_instance = "%s-%s" % (type, type_instance)
         else:
-            val.type_instance=type
-        val.values=[value]
-        val.interval = self.interval
-        val.dispatch()
-        self.logdebug("sent metric %s.%s.%s.%s.%s"
-                % (plugin, plugin_instance, type, type_instance, value))
+            type_instance = type
+        self.dispatch_flat([(plugin, [(plugin_instance, type_instance, value)], [])])
 
     def read_callback(self):
+        warm = None
+        if not self._warm_loaded:
+            self._warm_loaded = True
+            warm = self.load_state()
+        if self.background:
+            self.dispatch_snapshot()
+        elif warm is not None:
+            # collect on the next read, the first one only dispatches what
+            # was persisted before the restart
+            self.dispatch(warm)
+        else:
+            self.dispatch(self.collect())
+        self.dispatch_health()
+
+    def state_path(self):
+        name = self.prefix
+        if self.region is not None:
+            name = "%s-%s" % (name, self.region)
+        return os.path.join(self.state_dir, "%s.state" % name)
+
+    def save_state(self, stats, timestamp):
+        """
+        Persists the given stats, collected at timestamp, the collection
+        groups cache and the tenant list under StateDir, for warm restarts.
+        The file is gzipped json of plain data only, so loading it can't run
+        code, and is replaced atomically.
+        """
+        if not self.state_dir:
+            return
+        key = (self.auth_url, self.username, self.tenant)
+        tenants = tenant_cache.peek(key)
+        if tenants is not None:
+            tenants = (tenants[0], [tuple(tenant) for tenant in tenants[1]])
+        def plain_groups(collector):
+            return dict((group, (collector._group_times[group],
+                                 plain_stats(collector._group_stats[group])))
+                    for group in collector._group_stats)
+
+        state = {
+            'version': 2,
+            'time': timestamp,
+            'stats': plain_stats(stats),
+            'groups': plain_groups(self),
+            'tenants': tenants,
+        }
+        if len(self.regions) > 1:
+            # the region copies run the groups, with their own caches
+            state['regions'] = dict((collector.region, plain_groups(collector))
+                    for collector in self.get_region_collectors())
+        path = self.state_path()
         try:
-            start = datetime.datetime.now()
-            stats = self.get_stats()
-            self.logverbose("collectd new data from service :: took %d seconds"
-                    % (datetime.datetime.now() - start).seconds)
+            tmp = path + '.tmp'
+            with gzip.open(tmp, 'wb') as f:
+                f.write(json.dumps(state).encode('utf-8'))
+            os.rename(tmp, path)
+        except Exception as exc:
+            collectd.error("%s: failed to save state to %s :: %s" % (self.prefix, path, exc))
+
+    def load_state(self):
+        """
+        Restores the state saved by save_state, if it isn't older than
+        StateMaxAge: the tenant list and collection groups are reused, and
+        in background mode the stats are dispatched until the first
+        collection completes. Returns the restored stats, or None.
+        """
+        if not self.state_dir:
+            return None
+        path = self.state_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rb') as f:
+                state = json.loads(f.read().decode('utf-8'))
+            age = time.time() - state['time']
+            if state.get('version') != 2 or age > self.state_max_age:
+                self.logverbose("ignoring state from %d seconds ago in %s" % (age, path))
+                return None
+            stats = load_stats(state['stats'])
+
+            def load_groups(groups):
+                return dict((group, (timestamp, load_stats(group_stats)))
+                        for group, (timestamp, group_stats) in groups.items()
+                        if group in self.groups)
+
+            collectors = [(self, load_groups(state['groups']))]
+            if len(self.regions) > 1:
+                regions = state.get('regions', {})
+                collectors = [(collector, load_groups(regions.get(collector.region, {})))
+                        for collector in self.get_region_collectors()]
+            tenants = state['tenants']
+            if tenants is not None:
+                tenants = (tenants[0], [Tenant(*tenant) for tenant in tenants[1]])
+        except Exception as exc:
+            collectd.warning("%s: ignoring unreadable state in %s :: %s" % (self.prefix, path, exc))
+            return None
+
+        if tenants is not None:
+            tenant_cache.seed((self.auth_url, self.username, self.tenant), *tenants)
+        for collector, groups in collectors:
+            for group, (timestamp, group_stats) in groups.items():
+                collector._group_times[group] = timestamp
+                collector._group_stats[group] = group_stats
+        if self.background and self._snapshot is None:
+            # MaxAge counts from the restart, StateMaxAge bounding the age
+            self._snapshot = (time.time(), stats)
+        self.logverbose("restored state from %d seconds ago in %s" % (age, path))
+        return stats
+
+    def collect(self):
+        """
+        Runs get_stats, returning None if it failed. The time the stats
+        were collected at, earlier than now when the last ones are reused
+        (see get_stats_or_last), is left in collected_at.
+        """
+        stats = None
+        timestamp = time.time()
+        with self._health_lock:
+            self._health = self.new_health()
+        start = monotonic()
+        try:
+            if len(self.regions) > 1:
+                timestamp, stats = self.get_regions_stats()
+            else:
+                timestamp, stats = self.get_stats_or_last()
         except Exception as exc:
             collectd.error("%s: failed to get stats :: %s :: %s"
                     % (self.prefix, exc, traceback.format_exc()))
-        self.dispatch(stats)
+        duration = monotonic() - start
+        self.logverbose("collectd new data from service :: took %.3f seconds"
+                % duration)
+        with self._health_lock:
+            self._health['duration'] = duration
+            self._last_health = self._health
+        self.collected_at = timestamp
+        if stats:
+            self.save_state(stats, timestamp)
+        if self.debug:
+            for host, sent, opened in http_pool.stats():
+                self.logdebug("connection pool %s :: %d requests, %d on reused connections "
+                        "(pool hits), %d on new connections (pool misses)"
+                        % (host, sent, sent - opened, opened))
+        return stats
+
+    def get_stats_or_last(self):
+        """
+        Runs get_stats, returning (timestamp, stats). If it fails, e.g.
+        while the circuit breaker of the service is open, the stats of its
+        last success are returned instead, with the time they were collected
+        at, as long as they aren't older than stale_max_age. Their plugin
+        instances and age are reported in the collector.stale metrics.
+        Plugins with collection groups fall back per group instead, in
+        get_stats.
+        """
+        now = time.time()
+        try:
+            stats = self.get_stats()
+        except Exception as exc:
+            if self._last_stats is None:
+                raise
+            timestamp, stats = self._last_stats
+            age = now - timestamp
+            if age > self.stale_max_age():
+                self._last_stats = None
+                raise
+            collectd.error("%s: failed to get stats, using the last ones from %d seconds ago "
+                    ":: %s :: %s" % (self.prefix, age, exc, traceback.format_exc()))
+            self.record_stale(age, count_instances(stats))
+            return timestamp, stats
+        if stats:
+            self._last_stats = (now, stats)
+        return now, stats
+
+    def stale_max_age(self):
+        """
+        Returns the age past which the stats of a failed collection aren't
+        reused: MaxAge in background mode, StateMaxAge otherwise.
+        """
+        if self.background:
+            return self.max_age or 3 * self.interval
+        return self.state_max_age
+
+    def get_region_collectors(self):
+        """
+        Returns a copy of this plugin per configured region, sharing its
+        options, token and tenant list but with their own clients and
+        collection state.
+        """
+        if self._region_collectors is None:
+            collectors = []
+            for region in self.regions:
+                collector = copy.copy(self)
+                collector.region = region
+                collector.regions = [region]
+                collector._clients = {}
+                collector._pool = None
+                collector._last_good = {}
+                collector._group_stats = {}
+                collector._group_times = {}
+                collector._indexes = {}
+                collector._last_stats = None
+                collectors.append(collector)
+            self._region_collectors = collectors
+        return self._region_collectors
+
+    def get_regions_stats(self):
+        """
+        Runs get_stats for every region concurrently, prefixing plugin
+        instances with the region name, and returns (timestamp, stats), the
+        time of the oldest region's stats. A failing region only drops its
+        own stats.
+        """
+        collectors = self.get_region_collectors()
+        if self._region_pool is None:
+            self._region_pool = load('multiprocessing.pool', 'ThreadPool')(len(collectors))
+
+        def collect(collector):
+            # the copies account their requests in this collection's health
+            collector._health = self._health
+            try:
+                return collector.get_stats_or_last()
+            except Exception as exc:
+                collectd.error("%s: failed to get stats for region %s :: %s :: %s"
+                        % (self.prefix, collector.region, exc, traceback.format_exc()))
+                return None, None
+
+        tagged = []
+        oldest = time.time()
+        for collector, (timestamp, stats) in zip(collectors,
+                self._region_pool.map(collect, collectors)):
+            if stats:
+                tagged.append(prefix_stats(stats, collector.region))
+                oldest = min(oldest, timestamp)
+        if not tagged:
+            return oldest, None
+        return oldest, merge_stats(tagged)
+
+    def dispatch_snapshot(self):
+        """
+        Dispatches the latest stats collected by the background worker,
+        starting it on first use. Snapshots older than MaxAge are skipped.
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self.worker_loop,
+                    name="%s-collector" % self.prefix)
+            self._worker.daemon = True
+            self._worker.start()
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.logverbose("no stats collected yet, skipping dispatch")
+            return
+        age = time.time() - snapshot[0]
+        max_age = self.max_age or 3 * self.interval
+        if age > max_age:
+            collectd.warning("%s: latest stats are %d seconds old, skipping dispatch"
+                    % (self.prefix, age))
+            return
+        self.dispatch(snapshot[1])
+
+    def worker_loop(self):
+        """Collects stats every Interval seconds until shutdown."""
+        while not self._stopping.is_set():
+            start = time.time()
+            stats = self.collect()
+            if stats:
+                self._snapshot = (self.collected_at, stats)
+            self._stopping.wait(max(0, self.interval - (time.time() - start)))
+
+    def shutdown_callback(self):
+        self._stopping.set()
 
     def get_stats(self):
-        collectd.error('Not implemented, should be subclassed')
+        """
+        Retrieves stats by running the collection groups which are due.
+
+        Plugins declaring groups implement get_<group>_stats for each, and
+        the results of groups not due on this read are reused from the
+        last time they ran. When a group fails, its last results are reused
+        until they are overdue, i.e. older than the group interval, by more
+        than stale_max_age. Plugins without groups override get_stats.
+        """
+        if not self.groups:
+            collectd.error('Not implemented, should be subclassed')
+            return None
+
+        now = time.time()
+        for group in self.groups:
+            last = self._group_times.get(group)
+            interval = self.group_intervals.get(group, self.interval)
+            # half an interval of slack so reads jittering around the group
+            # interval don't skip a whole extra read
+            if last is not None and now - last + self.interval / 2 < interval:
+                continue
+            self._group_interval = interval
+            try:
+                with self.timed(group):
+                    self._group_stats[group] = getattr(self, 'get_%s_stats' % group)()
+                self._group_times[group] = now
+            except Exception as exc:
+                collectd.error("%s: failed to get %s stats, using the last ones if any :: %s :: %s"
+                        % (self.prefix, group, exc, traceback.format_exc()))
+                if group not in self._group_stats:
+                    continue
+                age = now - self._group_times[group]
+                if age - interval > self.stale_max_age():
+                    del self._group_stats[group]
+                else:
+                    self.record_stale(age, count_instances(self._group_stats[group]))
+            finally:
+                self._group_interval = 0
+
+        if not self._group_stats:
+            return None
+        return merge_stats(self._group_stats[group] for group in self.groups
+                if group in self._group_stats)
 
     def logverbose(self, msg):
         if self.verbose:
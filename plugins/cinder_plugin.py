@@ -35,58 +35,201 @@
 
 import traceback
 
+try:
+    from sys import intern
+except ImportError:
+    pass  # builtin on python 2
+
 import base
 
-from cinderclient.client import Client as CinderClient
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 import collectd
 
 
+def instance_name(value):
+    """
+    Returns value with its dots, which separate the parts of metric names,
+    replaced. Native strings are interned; on python 2 unicode ones can't
+    be, and are kept as they are.
+    """
+    value = value.replace('.', '_')
+    if isinstance(value, str):
+        value = intern(value)
+    return value
+
+
 class CinderPlugin(base.Base):
 
+    # first volume API microversion filtering listings on updated_at
+    CHANGES_VERSION = '3.60'
+
     def __init__(self):
         base.Base.__init__(self)
         self.prefix = 'openstack-cinder'
+        self._changes_client = None
 
     def get_stats(self):
         """Retrieves stats from cinder."""
-        keystone = self.get_keystone()
+        client = self.get_client('cinder', lambda session:
+                base.client_class('cinder')('2', session=session, region_name=self.region))
 
-        tenant_list = keystone.tenants.list()
+        tenant_list = self.get_tenants()
 
-        data = {self.prefix: {}}
+        table = base.StatsTable()
+        data = {self.prefix: [table]}
 
-        if getattr(self, 'region') is None:
-            client = CinderClient('2', self.username, self.password,
-                                  self.tenant, self.auth_url)
-        else:
-            client = CinderClient('2', self.username, self.password,
-                                  self.tenant, self.auth_url,
-                                  region_name=self.region)
         for tenant in tenant_list:
-            # TODO(xp) grab this list from the available volume types, rather
-            # than just the totals
-            data[self.prefix]["tenant-%s" % tenant.name] = {
-                'gigabytes': {'in_use': 0, 'limit': 0, 'reserved': 0},
-                'snapshots': {'in_use': 0, 'limit': 0, 'reserved': 0},
-                'volumes': {'in_use': 0, 'limit': 0, 'reserved': 0}
-            }
-            data_tenant = data[self.prefix]["tenant-%s" % tenant.name]
-            try:
-                quotaset = client.quotas.get(tenant.id, usage=True)
-            except Exception as e:
-                collectd.error(str(e))
+            row = table.add_row("tenant-%s" % tenant.name)
+            for item in ('gigabytes', 'snapshots', 'volumes'):
+                for value in ('in_use', 'limit', 'reserved'):
+                    table.set(row, "%s-%s" % (item, value), 0)
+
+        def get_quotaset(tenant):
+            return self.call_api(client.quotas.get, tenant.id, usage=True)
+
+        def fill(table, row, quotaset):
+            for item in ('gigabytes', 'snapshots', 'volumes'):
+                for value, amount in getattr(quotaset, item).items():
+                    table.set(row, "%s-%s" % (item, value), amount)
+
+        self.map_tenants(get_quotaset, fill, tenant_list, table)
+
+        if self.volume_usage:
+            data[self.prefix].append(self.get_volume_usage_stats(client, tenant_list))
+        return data
+
+    def get_changes_client(self):
+        """
+        Returns a volume API client at CHANGES_VERSION, the first one
+        filtering listings on updated_at (v2 has no changes-since, and
+        ignores the filters it doesn't know). If the API or cinderclient is
+        older, Incremental is turned off and None returned.
+        """
+        if self._changes_client is not None:
+            return self._changes_client
+        version = self.CHANGES_VERSION
+        try:
+            client = self.get_client('cinder3', lambda session:
+                    base.client_class('cinder')(version, session=session,
+                                                region_name=self.region))
+        except Exception as exc:
+            return self.disable_incremental("cinderclient doesn't support it :: %s" % exc)
+        highest = self.call_api(base.load('cinderclient.api_versions', 'get_highest_version'),
+                                client)
+        if highest < base.load('cinderclient.api_versions', 'APIVersion')(version):
+            return self.disable_incremental("the volume API only goes up to %s"
+                                            % highest.get_string())
+        self._changes_client = client
+        return client
+
+    def disable_incremental(self, reason):
+        collectd.error("%s: Incremental needs the volume API %s, disabling it: %s"
+                       % (self.prefix, self.CHANGES_VERSION, reason))
+        self.incremental = False
+        return None
+
+    def get_volume_usage_stats(self, client, tenant_list):
+        """
+        Accounts volumes and snapshots per tenant, volume type and backend,
+        from one paged listing of all the volumes and snapshots. With
+        Incremental, the volumes come from an index only updated with the
+        volumes changed since the last read instead.
+
+        Snapshots are listed first, summed per volume, so memory grows with
+        the number of volumes having snapshots; the volumes are then
+        streamed into counters per distinct (tenant, type, backend), with
+        interned strings, picking their snapshots' sums on the way. With
+        Incremental, the index holds an entry per volume anyway, and
+        snapshots are looked up in it instead.
+        Returns the plugin instances dict, as these are sparse.
+        """
+        names = dict((tenant.id, tenant.name) for tenant in tenant_list)
+        # volumes, gigabytes, snapshots, snapshot gigabytes per key
+        counters = {}
+        changes_client = self.get_changes_client() if self.incremental else None
+        if changes_client is not None:
+            # oldest change first, see GlancePlugin.get_incremental_stats
+            index = self.update_index('volumes', lambda since:
+                    self.scan_volumes(changes_client, since, 'updated_at:asc'))
+            for key, (count, size) in index.totals.items():
+                counters[key] = [count, size, 0, 0]
+            volumes = len(index.resources)
+            for snapshot in self.list_all(client, 'snapshots'):
+                entry = index.resources.get(snapshot.get('volume_id'))
+                if entry is not None:
+                    counter = counters[entry[0]]
+                    counter[2] += 1
+                    counter[3] += int(snapshot.get('size') or 0)
+        else:
+            # snapshots, snapshot gigabytes per volume id
+            snapshots = {}
+            for snapshot in self.list_all(client, 'snapshots'):
+                volume_snapshots = snapshots.get(snapshot.get('volume_id'))
+                if volume_snapshots is None:
+                    volume_snapshots = snapshots[snapshot.get('volume_id')] = [0, 0]
+                volume_snapshots[0] += 1
+                volume_snapshots[1] += int(snapshot.get('size') or 0)
+            volumes = 0
+            for id, key, size, status, updated_at in self.scan_volumes(client, None):
+                counter = counters.get(key)
+                if counter is None:
+                    counter = counters[key] = [0, 0, 0, 0]
+                counter[0] += 1
+                counter[1] += size
+                volume_snapshots = snapshots.get(id)
+                if volume_snapshots is not None:
+                    counter[2] += volume_snapshots[0]
+                    counter[3] += volume_snapshots[1]
+                volumes += 1
+
+        data = {}
+        for (tenant_id, volume_type, backend), counter in counters.items():
+            if tenant_id not in names:
                 continue
-            data_tenant['gigabytes'] = quotaset.gigabytes
-            data_tenant['snapshots'] = quotaset.snapshots
-            data_tenant['volumes'] = quotaset.volumes
-            data[self.prefix]["tenant-%s" % tenant.name] = data_tenant
+            data_tenant = data.setdefault("tenant-%s" % names[tenant_id], {})
+            data_tenant["usage-%s-%s" % (volume_type, backend)] = {
+                'volumes': counter[0], 'gigabytes': counter[1],
+                'snapshots': counter[2], 'snapshot_gigabytes': counter[3]}
+        self.logverbose("accounted %d volumes in %d tenant, type and backend combinations"
+                        % (volumes, len(counters)))
         return data
 
-try:
-    plugin = CinderPlugin()
-except Exception as exc:
-    collectd.error("openstack-cinder: failed to initialize cinder plugin :: %s :: %s"
-                   % (exc, traceback.format_exc()))
+    def list_all(self, client, collection, since=None, sort=None):
+        """
+        Yields the raw items of a collection ('volumes' or 'snapshots') for
+        all tenants, page by page, optionally only those updated since the
+        given time, which needs a client from get_changes_client, and in the
+        given order ('<key>:<asc|desc>') instead of the newest first.
+        """
+        url = '/%s/detail?all_tenants=1&limit=%d' % (collection, self.page_size)
+        if sort is not None:
+            url += '&sort=%s' % sort
+        if since is not None:
+            # needs CHANGES_VERSION
+            url += '&updated_at=gte:%s' % quote(since)
+        return self.list_raw(client.client.get, url, collection)
+
+    def scan_volumes(self, client, since, sort=None):
+        """
+        Yields (id, key, size, status, updated_at) for the volumes of all
+        tenants updated since the given time, in the given order (see
+        list_all), key being their (tenant, volume type, backend), one tuple
+        shared by all the volumes with the same.
+        """
+        keys = {}
+        for volume in self.list_all(client, 'volumes', since, sort):
+            volume_type = volume.get('volume_type') or 'none'
+            # host@backend#pool
+            backend = (volume.get('os-vol-host-attr:host') or 'unknown').split('#')[0]
+            key = (volume.get('os-vol-tenant-attr:tenant_id'), instance_name(volume_type),
+                   instance_name(backend))
+            yield (volume['id'], keys.setdefault(key, key), int(volume.get('size') or 0),
+                   volume.get('status'), volume.get('updated_at'))
+
+plugin = None
 
 
 def configure_callback(conf):
@@ -98,5 +241,23 @@ def read_callback():
     """Callback triggerred by collectd on read."""
     plugin.read_callback()
 
-collectd.register_config(configure_callback)
-collectd.register_read(read_callback, plugin.interval)
+
+def shutdown_callback():
+    """Callback triggerred by collectd on shutdown."""
+    plugin.shutdown_callback()
+
+
+def register():
+    """Creates the plugin and registers its callbacks with collectd."""
+    global plugin
+    try:
+        plugin = CinderPlugin()
+    except Exception as exc:
+        collectd.error("openstack-cinder: failed to initialize cinder plugin :: %s :: %s"
+                       % (exc, traceback.format_exc()))
+    collectd.register_config(configure_callback)
+    collectd.register_read(read_callback, plugin.interval)
+    collectd.register_shutdown(shutdown_callback)
+
+
+base.register_module(__name__, register)
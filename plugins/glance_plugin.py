@@ -29,7 +29,10 @@
 # collectd-python:
 #   http://collectd.org/documentation/manpages/collectd-python.5.shtml
 #
-from glanceclient.v2.client import Client as GlanceClient
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 
 import collectd
 import traceback
@@ -44,31 +47,117 @@ class GlancePlugin(base.Base):
 
     def get_stats(self):
         """Retrieves stats from glance"""
-        keystone = self.get_keystone()
+        client = self.get_client('glance', lambda session:
+                base.client_class('glance')(self.get_endpoint('image'), session=session))
 
-        data = { self.prefix: {} }
-        glance_endpoint = keystone.service_catalog.url_for(service_type='image')
+        table = base.StatsTable(('images-count', 'images-bytes'))
+        data = { self.prefix: table }
 
-        tenant_list = keystone.tenants.list()
-        client = GlanceClient(glance_endpoint, token=keystone.auth_token)
+        tenant_list = self.get_tenants()
         for tenant in tenant_list:
-            data[self.prefix]["tenant-%s" % tenant.name] = { 'images': {} }
-            data_tenant = data[self.prefix]["tenant-%s" % tenant.name]
-            data_tenant['images']['count'] = 0
-            data_tenant['images']['bytes'] = 0
+            self.add_row(table, "tenant-%s" % tenant.name)
+
+        if self.incremental:
+            self.get_incremental_stats(client, table, tenant_list)
+            return data
+        if self.bulk:
+            self.get_bulk_stats(client, table, tenant_list)
+            return data
 
-            image_list = client.images.list(filters={'owner': tenant.id})
+        count = table.column('images-count')
+        size = table.column('images-bytes')
+        for tenant in tenant_list:
+            row = table.index["tenant-%s" % tenant.name]
+            image_list = self.call_api(lambda:
+                    list(client.images.list(filters={'owner': tenant.id})))
             for image in image_list:
-                data_tenant['images']['count'] += 1
-                data_tenant['images']['bytes'] += int(image['size']) if image['size'] else 0
+                count[row] += 1
+                size[row] += int(image['size']) if image['size'] else 0
 
         return data
 
-try:
-    plugin = GlancePlugin()
-except Exception as exc:
-    collectd.error("openstack-glance: failed to initialize glance plugin :: %s :: %s"
-            % (exc, traceback.format_exc()))
+    def add_row(self, table, name):
+        """Adds a row of zero images to the table."""
+        row = table.add_row(name)
+        table.set(row, 'images-count', 0)
+        table.set(row, 'images-bytes', 0)
+        return row
+
+    def get_owners(self, table, tenant_list):
+        """
+        Returns the table row of each tenant by id, and the row of images
+        whose owner is not a known tenant, only kept by the first shard.
+        Tenants other shards are in charge of have no row (None).
+        """
+        owners = {}
+        if self.shard_peers:
+            for tenant in self.get_all_tenants():
+                owners[tenant.id] = None
+        for tenant in tenant_list:
+            owners[tenant.id] = table.index["tenant-%s" % tenant.name]
+        unknown = self.add_row(table, 'unknown') if self.is_primary() else None
+        return owners, unknown
+
+    def get_bulk_stats(self, client, table, tenant_list):
+        """
+        Pages through all images once, accumulating count and bytes per owner.
+
+        The raw json pages are read directly, keeping only owner and size,
+        instead of building a model object per image. Images whose owner is
+        not a known tenant are accounted under 'unknown', by the first shard
+        only.
+        """
+        owners, unknown = self.get_owners(table, tenant_list)
+        count = table.column('images-count')
+        size = table.column('images-bytes')
+
+        for owner, image_size in self.list_images(client):
+            row = owners.get(owner, unknown)
+            if row is not None:
+                count[row] += 1
+                size[row] += int(image_size or 0)
+
+    def list_images(self, client):
+        """
+        Yields (owner, size) of all images, reading the raw json pages, or
+        with AsyncFetch from the asyncio engine, which prefetches the next
+        page while the current one is processed.
+        """
+        path = '/v2/images?limit=%d' % self.page_size
+        if self.async_fetch:
+            for image in self.fetch_rows('image', path, 'images', ('owner', 'size')):
+                yield image
+            return
+        for image in self.list_raw(client.http_client.get, path, 'images'):
+            yield image.get('owner'), image.get('size')
+
+    def get_incremental_stats(self, client, table, tenant_list):
+        """
+        Like get_bulk_stats, from an index of all images only updated with
+        the images changed since the last scan.
+        """
+        def scan(since):
+            # oldest change first, instead of the newest image first, so an
+            # image updated during the scan can't be on a page already read
+            # while a later one moves the high-water mark past it
+            url = '/v2/images?limit=%d&sort_key=updated_at&sort_dir=asc' % self.page_size
+            if since is not None:
+                url += '&updated_at=%s' % quote('gte:%s' % since)
+            for image in self.list_raw(client.http_client.get, url, 'images'):
+                yield (image['id'], image.get('owner'), int(image.get('size') or 0),
+                        image.get('status'), image.get('updated_at'))
+
+        index = self.update_index('images', scan)
+        owners, unknown = self.get_owners(table, tenant_list)
+        count = table.column('images-count')
+        size = table.column('images-bytes')
+        for owner, (images, images_size) in index.totals.items():
+            row = owners.get(owner, unknown)
+            if row is not None:
+                count[row] += images
+                size[row] += images_size
+
+plugin = None
 
 def configure_callback(conf):
     """Received configuration information"""
@@ -78,5 +167,20 @@ def read_callback():
     """Callback triggerred by collectd on read"""
     plugin.read_callback()
 
-collectd.register_config(configure_callback)
-collectd.register_read(read_callback, plugin.interval)
+def shutdown_callback():
+    """Callback triggerred by collectd on shutdown"""
+    plugin.shutdown_callback()
+
+def register():
+    """Creates the plugin and registers its callbacks with collectd"""
+    global plugin
+    try:
+        plugin = GlancePlugin()
+    except Exception as exc:
+        collectd.error("openstack-glance: failed to initialize glance plugin :: %s :: %s"
+                % (exc, traceback.format_exc()))
+    collectd.register_config(configure_callback)
+    collectd.register_read(read_callback, plugin.interval)
+    collectd.register_shutdown(shutdown_callback)
+
+base.register_module(__name__, register)
@@ -47,29 +47,57 @@ class KeystonePlugin(base.Base):
         data = { self.prefix: {} }
 
         # Total for usual keystone stats
-        data[self.prefix]['totals'] = { 
-          'tenants': 0, 'users': 'users', 'roles': 0, 'services': 0, 'endpoints': 0 }
-        for item in ('tenants', 'users', 'roles', 'services', 'endpoints'):
-            data[self.prefix]['totals'][item] = { 
-                'count': len(keystone.__getattribute__(item).list())
-            }
-
-        if getattr(self, 'notenants') == False:
+        tenant_list = self.get_tenants()
+        if self.is_primary():
+            data[self.prefix]['totals'] = { 
+              'tenants': 0, 'users': 'users', 'roles': 0, 'services': 0, 'endpoints': 0 }
+            data[self.prefix]['totals']['tenants'] = { 'count': len(self.get_all_tenants()) }
+            for item in ('users', 'roles', 'services', 'endpoints'):
+                if item == 'users' and self.async_fetch:
+                    count = sum(1 for user in self.fetch_rows('identity', '/users',
+                            'users', ('id',), interface='admin'))
+                else:
+                    count = len(self.call_api(keystone.__getattribute__(item).list))
+                data[self.prefix]['totals'][item] = { 'count': count }
+
+        table = base.StatsTable(('users-count',))
+        if getattr(self, 'notenants') == False and self.bulk:
+            # User count per tenant, from a single role assignment listing
+            users = self.get_project_users()
+            for tenant in tenant_list:
+                row = table.add_row("tenant-%s" % tenant.name)
+                table.set(row, 'users-count', len(users.get(tenant.id, ())))
+        elif getattr(self, 'notenants') == False:
             # User count per tenant
-            tenant_list = keystone.tenants.list()
             for tenant in tenant_list:
-                data[self.prefix]["tenant-%s" % tenant.name] = { 'users': {} }
-                data_tenant = data[self.prefix]["tenant-%s" % tenant.name]
-                data_tenant['users']['count'] = len(keystone.tenants.list_users(tenant.id))
+                row = table.add_row("tenant-%s" % tenant.name)
+                table.set(row, 'users-count',
+                        len(self.call_api(keystone.tenants.list_users, tenant.id)))
 
+        data[self.prefix] = [data[self.prefix], table]
         return data
 
-try:
-    plugin = KeystonePlugin()
-except Exception as exc:
-    collectd.error("openstack-keystone: failed to initialize keystone plugin :: %s :: %s"
-            % (exc, traceback.format_exc()))
-    
+    def get_project_users(self):
+        """
+        Returns the ids of the users having a role on each project, keyed by
+        project id, from a single listing of all effective role assignments:
+        like the v2 tenant users listing, users holding a role through a
+        group membership or an inherited assignment are counted.
+        """
+        keystone = self.get_client('keystone3', lambda session:
+                base.client_class('keystone3')(session=session, region_name=self.region))
+        users = {}
+        for assignment in self.call_api(keystone.role_assignments.list, effective=True):
+            user = getattr(assignment, 'user', None)
+            project = getattr(assignment, 'scope', {}).get('project')
+            if user is None or project is None:
+                # domain assignments
+                continue
+            users.setdefault(project['id'], set()).add(user['id'])
+        return users
+
+plugin = None
+
 def configure_callback(conf):
     """Received configuration information"""
     plugin.config_callback(conf)
@@ -78,5 +106,20 @@ def read_callback():
     """Callback triggerred by collectd on read"""
     plugin.read_callback()
 
-collectd.register_config(configure_callback)
-collectd.register_read(read_callback, plugin.interval)
+def shutdown_callback():
+    """Callback triggerred by collectd on shutdown"""
+    plugin.shutdown_callback()
+
+def register():
+    """Creates the plugin and registers its callbacks with collectd"""
+    global plugin
+    try:
+        plugin = KeystonePlugin()
+    except Exception as exc:
+        collectd.error("openstack-keystone: failed to initialize keystone plugin :: %s :: %s"
+                % (exc, traceback.format_exc()))
+    collectd.register_config(configure_callback)
+    collectd.register_read(read_callback, plugin.interval)
+    collectd.register_shutdown(shutdown_callback)
+
+base.register_module(__name__, register)
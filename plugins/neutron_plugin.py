@@ -29,8 +29,6 @@
 #   http://collectd.org/documentation/manpages/collectd-python.5.shtml
 #
 #
-from neutronclient.neutron.client import Client as NeutronClient
-
 import collectd
 import traceback
 
@@ -44,66 +42,81 @@ class NeutronPlugin(base.Base):
 
     def get_stats(self):
         """Retrieves stats from neutron"""
-        keystone = self.get_keystone()
+        client = self.get_client('neutron', lambda session:
+                base.client_class('neutron')('2.0', session=session, region_name=self.region))
 
-        data = { self.prefix: {} }
+        table = base.StatsTable(('networks-count', 'subnets-count', 'routers-count',
+                'ports-count', 'floatingips-count'))
+        data = { self.prefix: table }
 
         tenants = {}
-        tenant_list = keystone.tenants.list()
+        tenant_list = self.get_tenants()
         for tenant in tenant_list:
-            tenants[tenant.id] = tenant.name
-            data[self.prefix]["tenant-%s" % tenant.name] = {
-                    'quotas': {},
-                    'networks': { 'count': 0, },
-                    'subnets': { 'count': 0,  },
-                    'routers': { 'count': 0,  },
-                    'ports': { 'count': 0,  },
-                    'floatingips': { 'count': 0, },
-            }
-
-        neutron_endpoint = keystone.service_catalog.url_for(service_type='network')
-
-        client = NeutronClient('2.0', endpoint_url=neutron_endpoint, token=keystone.auth_token)
-
-        # Get network count
-        network_list = client.list_networks()['networks']
-        for network in network_list:
-            try:
-                tenant = tenants[network['tenant_id']]
-            except KeyError:
-                continue
-            data[self.prefix]["tenant-%s" % tenant]['networks']['count'] += 1
-            for subnet in network['subnets']:
-                data[self.prefix]["tenant-%s" % tenant]['subnets']['count'] += 1
-
-        # Get floating ips
-        floatingip_list = client.list_floatingips()['floatingips']
-        for floatingip in floatingip_list:
+            row = tenants[tenant.id] = table.add_row("tenant-%s" % tenant.name)
+            for values in table.columns:
+                values[row] = 0
+
+        # Get network, subnet, router, port and floating ip count
+        listings = (('networks', ['tenant_id', 'subnets']), ('routers', ['tenant_id']),
+                ('ports', ['tenant_id']), ('floatingips', ['tenant_id']))
+        counts = [table.column("%s-count" % collection) for collection, fields in listings]
+        subnets = table.column('subnets-count')
+        for listing, resource in self.list_all_paged(client, listings):
             try:
-                tenant = tenants[floatingip['tenant_id']]
+                row = tenants[resource[0]]
             except KeyError:
                 continue
-            data[self.prefix]["tenant-%s" % tenant]['floatingips']['count'] += 1
+            counts[listing][row] += 1
+            if listing == 0:
+                subnets[row] += len(resource[1])
 
         # Get network quotas
-        quotas = client.list_quotas()['quotas']
+        quotas = self.call_api(client.list_quotas)['quotas']
         for quota in quotas:
             try:
-                data_tenant = data[self.prefix]["tenant-%s" % tenants[quota['tenant_id']]]
+                row = tenants[quota['tenant_id']]
             except KeyError:
                 continue
             for item in ('floatingip', 'ikepolicy', 'ipsec_site_connection',
                   'ipsecpolicy', 'network', 'port', 'router',
                   'security_group', 'security_group_rule', 'subnet'):
-                data_tenant['quotas'][item] = quota[item]
+                table.set(row, "quotas-%s" % item, quota[item])
 
         return data
 
-try:
-    plugin = NeutronPlugin()
-except Exception as exc:
-    collectd.error("openstack-neutron: failed to initialize neutron plugin :: %s :: %s"
-            % (exc, traceback.format_exc()))
+    def list_all_paged(self, client, listings):
+        """
+        Yields (listing, resource) for the resources of the given
+        (collection, fields) listings, listing being the position of the
+        resource's listing, as tuples of the fields (see list_paged).
+
+        With AsyncFetch, all the listings are fetched at once by the asyncio
+        engine, their pages interleaved as they arrive, so a read takes
+        about as long as the longest listing rather than all of them.
+        """
+        if self.async_fetch:
+            for item in self.fetch_listings('network', [("/v2.0/%s?%s&limit=%d"
+                    % (collection, '&'.join("fields=%s" % field for field in fields),
+                    self.page_size), collection, fields) for collection, fields in listings]):
+                yield item
+            return
+        for listing, (collection, fields) in enumerate(listings):
+            lister = getattr(client, "list_%s" % collection)
+            for resource in self.list_paged(lister, collection, fields):
+                yield listing, resource
+
+    def list_paged(self, lister, collection, fields):
+        """
+        Yields the resources of a collection as tuples of the given fields,
+        one page at a time, requesting only those fields, so memory is
+        bounded by PageSize rather than by the number of resources.
+        """
+        pages = lister(retrieve_all=False, fields=fields, limit=self.page_size)
+        for page in self.iter_pages(pages):
+            for resource in page[collection]:
+                yield tuple(resource.get(field) for field in fields)
+
+plugin = None
 
 def configure_callback(conf):
     """Received configuration information"""
@@ -113,5 +126,20 @@ def read_callback():
     """Callback triggerred by collectd on read"""
     plugin.read_callback()
 
-collectd.register_config(configure_callback)
-collectd.register_read(read_callback, plugin.interval)
+def shutdown_callback():
+    """Callback triggerred by collectd on shutdown"""
+    plugin.shutdown_callback()
+
+def register():
+    """Creates the plugin and registers its callbacks with collectd"""
+    global plugin
+    try:
+        plugin = NeutronPlugin()
+    except Exception as exc:
+        collectd.error("openstack-neutron: failed to initialize neutron plugin :: %s :: %s"
+                % (exc, traceback.format_exc()))
+    collectd.register_config(configure_callback)
+    collectd.register_read(read_callback, plugin.interval)
+    collectd.register_shutdown(shutdown_callback)
+
+base.register_module(__name__, register)
@@ -29,10 +29,8 @@
 # collectd-python:
 #   http://collectd.org/documentation/manpages/collectd-python.5.shtml
 #
-from novaclient.client import Client as NovaClient
-from novaclient import exceptions
-
 import collectd
+import time
 import traceback
 
 import base
@@ -42,96 +40,218 @@ class NovaPlugin(base.Base):
     def __init__(self):
         base.Base.__init__(self)
         self.prefix = 'openstack-nova'
+        self._flavors = (0, {})
+
+    # Collection groups, each run every GroupInterval seconds (defaulting
+    # to Interval) by get_<group>_stats
+    groups = ('hypervisors', 'tenant_limits', 'tenant_quotas', 'server_usage')
+
+    def get_nova(self):
+        """Returns the nova client."""
+        return self.get_client('nova', lambda session:
+                base.client_class('nova')('2', session=session, region_name=self.region))
+
+    def get_tenant_limits_stats(self):
+        """Retrieves absolute limits per tenant"""
+        client = self.get_nova()
+        data = { self.prefix: {} }
+        if getattr(self, 'notenants') == True:
+            return data
+
+        def get_limits(tenant):
+            return self.call_api(client.limits.get, tenant_id=tenant.id).absolute
+
+        def fill(table, row, limits):
+            for limit in limits:
+                value = limit.value
+                if 'ram' in limit.name.lower():
+                    value = value * 1024.0 * 1024.0
+                table.set(row, "limits-%s" % limit.name, value)
+
+        data[self.prefix] = self.map_tenants(get_limits, fill, self.get_tenants())
+        return data
+
+    def get_tenant_quotas_stats(self):
+        """Retrieves quotas per tenant"""
+        client = self.get_nova()
+        data = { self.prefix: {} }
+        if getattr(self, 'notenants') == True:
+            return data
+
+        def get_quotas(tenant):
+            return self.call_api(client.quotas.get, tenant.id)
+
+        def fill(table, row, quotas):
+            for item in ('cores', 'fixed_ips', 'floating_ips', 'instances',
+                'key_pairs', 'ram', 'security_groups'):
+                value = getattr(quotas, item)
+                if item == 'ram':
+                    value = value * 1024 * 1024
+                table.set(row, "quotas-%s" % item, value)
+
+        data[self.prefix] = self.map_tenants(get_quotas, fill, self.get_tenants())
+        return data
 
-    def get_stats(self):
-        """Retrieves stats from nova"""
-        keystone = self.get_keystone()
-
-        data = { self.prefix: { 'cluster': { 'config': {} }, } }
-        if getattr(self, 'region') is None:
-            client = NovaClient('2', self.username, self.password, self.tenant, self.auth_url)
-        else:
-            client = NovaClient('2', self.username, self.password, self.tenant, self.auth_url,
-                                region_name=self.region)
-
-        if getattr(self, 'notenants') == False:
-            tenant_list = keystone.tenants.list()
-
-            for tenant in tenant_list:
-                # FIX: nasty but works for now (tenant.id not being taken below :()
-                client.tenant_id = tenant.id
-                data[self.prefix]["tenant-%s" % tenant.name] = { 'limits': {}, 'quotas': {} }
-                data_tenant = data[self.prefix]["tenant-%s" % tenant.name]
-
-                # Get absolute limits for tenant
-                limits = client.limits.get(tenant_id=tenant.id).absolute
-                for limit in limits:
-                    if 'ram' in limit.name.lower():
-                        limit.value = limit.value * 1024.0 * 1024.0
-                    data_tenant['limits'][limit.name] = limit.value
-
-                # Quotas for tenant
-                quotas = client.quotas.get(tenant.id)
-                for item in ('cores', 'fixed_ips', 'floating_ips', 'instances',
-                    'key_pairs', 'ram', 'security_groups'):
-                    if item == 'ram':
-                        setattr(quotas, item, getattr(quotas, item) * 1024 * 1024)
-                    data_tenant['quotas'][item] = getattr(quotas, item)
+    def get_hypervisors_stats(self):
+        """Retrieves cluster config and hypervisor stats"""
+        if not self.is_primary():
+            return { self.prefix: {} }
+        client = self.get_nova()
+        config = {}
 
         # Cluster allocation / reserved values
         for item in ('AllocationRatioCores', 'AllocationRatioRam',
                 'ReservedNodeCores', 'ReservedNodeRamMB',
                 'ReservedCores', 'ReservedRamMB'):
-            data[self.prefix]['cluster']['config'][item] = getattr(self, item)
+            config[item] = getattr(self, item)
 
         # Hypervisor information
-        hypervisors = client.hypervisors.list()
+        table = base.StatsTable()
+        hosts = {}
+        hypervisors = self.call_api(client.hypervisors.list)
         for hypervisor in hypervisors:
-            name = "hypervisor-%s" % hypervisor.hypervisor_hostname
-            data[self.prefix][name] = {}
+            hostname = hypervisor.hypervisor_hostname
+            row = table.add_row("hypervisor-%s" % hostname)
             for item in ('current_workload', 'free_disk_gb', 'free_ram_mb',
                     'hypervisor_version', 'memory_mb', 'memory_mb_used',
                     'running_vms', 'vcpus', 'vcpus_used'):
-                data[self.prefix][name][item] = getattr(hypervisor, item)
-            data[self.prefix][name]['memory_mb_overcommit'] = \
-                data[self.prefix][name]['memory_mb'] * data[self.prefix]['cluster']['config']['AllocationRatioRam']
-            data[self.prefix][name]['memory_mb_overcommit_withreserve'] = \
-                data[self.prefix][name]['memory_mb_overcommit'] - data[self.prefix]['cluster']['config']['ReservedNodeRamMB']
-            data[self.prefix][name]['vcpus_overcommit'] = \
-                data[self.prefix][name]['vcpus'] * data[self.prefix]['cluster']['config']['AllocationRatioCores']
-            data[self.prefix][name]['vcpus_overcommit_withreserve'] = \
-                data[self.prefix][name]['vcpus_overcommit'] - data[self.prefix]['cluster']['config']['ReservedNodeCores']
+                table.set(row, item, getattr(hypervisor, item))
+            # aggregates list hosts by their short name
+            hosts.setdefault(hostname.split('.')[0], []).append((hostname, row))
+
+        table.derive('memory_mb_overcommit',
+                lambda memory: memory * config['AllocationRatioRam'], 'memory_mb')
+        table.derive('memory_mb_overcommit_withreserve',
+                lambda memory: memory - config['ReservedNodeRamMB'], 'memory_mb_overcommit')
+        table.derive('vcpus_overcommit',
+                lambda vcpus: vcpus * config['AllocationRatioCores'], 'vcpus')
+        table.derive('vcpus_overcommit_withreserve',
+                lambda vcpus: vcpus - config['ReservedNodeCores'], 'vcpus_overcommit')
 
         # NOTE(flwang): Below data will do the similar thing as above, but only
-        # for windows host.
-        aggregates = client.aggregates.list()
+        # for hosts in aggregates with the given metadata, e.g. windows hosts.
+        metadata = self.aggregate_metadata or [('os_distro', 'windows')]
+        aggregates = self.call_api(client.aggregates.list)
         for aggregate in aggregates:
-            if aggregate.metadata.get('os_distro', None) == 'windows':
+            for key, value in metadata:
+                if aggregate.metadata.get(key, None) != value:
+                    continue
                 for host in aggregate.hosts:
-                    for hypervisor in hypervisors:
-                        if hypervisor.hypervisor_hostname.startswith(host):
-                            name = "windows-hypervisor-%s" % hypervisor.hypervisor_hostname
-                            data[self.prefix][name] = {}
-                            for item in ('current_workload', 'free_disk_gb', 'free_ram_mb',
-                                    'hypervisor_version', 'memory_mb', 'memory_mb_used',
-                                    'running_vms', 'vcpus', 'vcpus_used'):
-                                data[self.prefix][name][item] = getattr(hypervisor, item)
-                            data[self.prefix][name]['memory_mb_overcommit'] = \
-                                data[self.prefix][name]['memory_mb'] * data[self.prefix]['cluster']['config']['AllocationRatioRam']
-                            data[self.prefix][name]['memory_mb_overcommit_withreserve'] = \
-                                data[self.prefix][name]['memory_mb_overcommit'] - data[self.prefix]['cluster']['config']['ReservedNodeRamMB']
-                            data[self.prefix][name]['vcpus_overcommit'] = \
-                                data[self.prefix][name]['vcpus'] * data[self.prefix]['cluster']['config']['AllocationRatioCores']
-                            data[self.prefix][name]['vcpus_overcommit_withreserve'] = \
-                                data[self.prefix][name]['vcpus_overcommit'] - data[self.prefix]['cluster']['config']['ReservedNodeCores']
+                    for hostname, row in hosts.get(host.split('.')[0], ()):
+                        table.copy_row(row, "%s-hypervisor-%s" % (value, hostname))
+
+        return { self.prefix: [{ 'cluster': { 'config': config } }, table] }
+
+    def get_flavors(self, client):
+        """
+        Returns (vcpus, ram in MB, disk in GB) by flavor id, including
+        private flavors, refetched every FlavorCacheTTL seconds. The
+        flavors looked up with get_flavor are kept along until then.
+        """
+        timestamp, flavors = self._flavors
+        if time.time() - timestamp > self.flavor_cache_ttl:
+            flavors = {}
+            for flavor in self.call_api(client.flavors.list, is_public=None):
+                flavors[flavor.id] = flavor_resources(flavor)
+            self._flavors = (time.time(), flavors)
+            self.logverbose("fetched %d flavors" % len(flavors))
+        return flavors
+
+    def get_flavor(self, client, flavors, flavor_id):
+        """
+        Returns (vcpus, ram in MB, disk in GB) of a flavor missing from the
+        given flavors, i.e. from get_flavors, or None if it doesn't exist.
+        Unlike the listing, showing a flavor finds deleted ones too, which
+        servers booted before their deletion still use. Misses are cached
+        along, so each unknown id is looked up once per FlavorCacheTTL.
+        """
+        try:
+            resources = flavor_resources(self.call_api(client.flavors.get, flavor_id))
+        except Exception as exc:
+            if base.http_status(exc) != 404:
+                raise
+            resources = None
+        flavors[flavor_id] = resources
+        self.logverbose("looked up flavor %s :: %s" % (flavor_id,
+                "found" if resources is not None else "not found"))
+        return resources
+
+    def list_servers(self, client):
+        """Yields the raw servers of all tenants, page by page."""
+        url = '/servers/detail?all_tenants=1&limit=%d' % self.page_size
+        return self.list_raw(client.client.get, url, 'servers')
 
+    def get_server_usage_stats(self):
+        """
+        Retrieves instances, cores, ram and disk in use, and instances by
+        status, per tenant and per hypervisor, from one paged listing of
+        the servers of all tenants joined with the flavors.
+        """
+        data = { self.prefix: {} }
+        if not self.server_usage:
+            return data
+        client = self.get_nova()
+        flavors = self.get_flavors(client)
+        # servers whose flavor couldn't be resolved
+        unknown = []
+
+        names = {}
+        if not self.notenants:
+            names = dict((tenant.id, tenant.name) for tenant in self.get_tenants())
+        hypervisors = self.is_primary()
+        usages = {}
+        for server in self.list_servers(client):
+            flavor = server.get('flavor') or {}
+            if 'vcpus' in flavor:
+                # embedded since compute API microversion 2.47
+                resources = (flavor['vcpus'], flavor['ram'],
+                        flavor['disk'] + (flavor.get('ephemeral') or 0))
+            else:
+                flavor_id = flavor.get('id')
+                if flavor_id in flavors:
+                    resources = flavors[flavor_id]
+                else:
+                    resources = self.get_flavor(client, flavors, flavor_id)
+                if resources is None:
+                    unknown.append((server.get('id'), flavor_id))
+                    resources = (0, 0, 0)
+            status = (server.get('status') or 'unknown').lower()
+
+            instances = []
+            tenant_id = server.get('tenant_id')
+            if tenant_id in names:
+                instances.append("tenant-%s" % names[tenant_id])
+            hostname = server.get('OS-EXT-SRV-ATTR:hypervisor_hostname')
+            if hypervisors and hostname:
+                instances.append("hypervisor-%s" % hostname)
+            for instance in instances:
+                usage = usages.get(instance)
+                if usage is None:
+                    usage = usages[instance] = { 'usage': { 'instances': 0,
+                            'cores': 0, 'ram': 0, 'disk_gb': 0 }, 'status': {} }
+                totals = usage['usage']
+                totals['instances'] += 1
+                totals['cores'] += resources[0]
+                totals['ram'] += resources[1] * 1024 * 1024
+                totals['disk_gb'] += resources[2]
+                usage['status'][status] = usage['status'].get(status, 0) + 1
+
+        if unknown:
+            server_id, flavor_id = unknown[0]
+            collectd.warning("%s: %d servers have an unknown flavor, their cores, ram and "
+                    "disk are not counted :: server %s flavor %s"
+                    % (self.prefix, len(unknown), server_id, flavor_id))
+            for server_id, flavor_id in unknown[1:]:
+                self.logverbose("server %s has unknown flavor %s" % (server_id, flavor_id))
+        data[self.prefix] = usages
         return data
 
-try:
-    plugin = NovaPlugin()
-except Exception as exc:
-    collectd.error("openstack-nova: failed to initialize nova plugin :: %s :: %s"
-            % (exc, traceback.format_exc()))
+def flavor_resources(flavor):
+    """Returns (vcpus, ram in MB, disk in GB) of a novaclient flavor."""
+    return (flavor.vcpus, flavor.ram, flavor.disk +
+            (getattr(flavor, 'OS-FLV-EXT-DATA:ephemeral', 0) or 0))
+
+plugin = None
 
 def configure_callback(conf):
     """Received configuration information"""
@@ -141,5 +261,20 @@ def read_callback():
     """Callback triggerred by collectd on read"""
     plugin.read_callback()
 
-collectd.register_config(configure_callback)
-collectd.register_read(read_callback, plugin.interval)
+def shutdown_callback():
+    """Callback triggerred by collectd on shutdown"""
+    plugin.shutdown_callback()
+
+def register():
+    """Creates the plugin and registers its callbacks with collectd"""
+    global plugin
+    try:
+        plugin = NovaPlugin()
+    except Exception as exc:
+        collectd.error("openstack-nova: failed to initialize nova plugin :: %s :: %s"
+                % (exc, traceback.format_exc()))
+    collectd.register_config(configure_callback)
+    collectd.register_read(read_callback, plugin.interval)
+    collectd.register_shutdown(shutdown_callback)
+
+base.register_module(__name__, register)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# vim: tabstop=4 shiftwidth=4
+
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; only version 2 of the License is applicable.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# About this plugin:
+#   Single entry point running the keystone, nova, cinder, glance and
+#   neutron plugins as sub-collectors of one read callback. They share
+#   authentication, the tenant list and the HTTP connection pool, and their
+#   collections are spread evenly over the interval instead of all
+#   starting at once.
+#
+#   Options outside of <Service> blocks apply to every service, and each
+#   <Service "name"> block enables that service, with its own options:
+#
+#   <Module "openstack_plugin">
+#       Username "admin"
+#       Password "123456"
+#       TenantName "openstack"
+#       AuthURL "https://api.example.com:5000/v2.0"
+#       <Service "nova">
+#           AllocationRatioCores 16
+#           ...
+#       </Service>
+#       <Service "glance">
+#           Bulk true
+#       </Service>
+#   </Module>
+#
+# collectd:
+#   http://collectd.org
+# collectd-python:
+#   http://collectd.org/documentation/manpages/collectd-python.5.shtml
+#
+import collectd
+import sys
+import traceback
+
+import base
+
+# the service plugin modules are only imported for their classes, without
+# creating their plugin nor registering their callbacks
+base.embedded = True
+try:
+    import cinder_plugin
+    import glance_plugin
+    import keystone_plugin
+    import neutron_plugin
+    import nova_plugin
+finally:
+    base.embedded = False
+
+for module in (cinder_plugin, glance_plugin, keystone_plugin, neutron_plugin, nova_plugin):
+    if module.__name__ in base.standalone:
+        collectd.warning("%s is loaded next to openstack_plugin, a service configured in "
+                "both is collected twice" % module.__name__)
+    else:
+        # forgotten, so importing the module on its own afterwards, e.g.
+        # while migrating to this one, loads it again and registers it
+        del sys.modules[module.__name__]
+base.unified = True
+
+COLLECTORS = {
+    'keystone': keystone_plugin.KeystonePlugin,
+    'nova': nova_plugin.NovaPlugin,
+    'cinder': cinder_plugin.CinderPlugin,
+    'glance': glance_plugin.GlancePlugin,
+    'neutron': neutron_plugin.NeutronPlugin,
+}
+
+class Config(object):
+    """A collectd config node made of the given children."""
+
+    def __init__(self, children):
+        self.children = children
+
+class OpenStackPlugin(object):
+
+    def __init__(self):
+        self.prefix = 'openstack'
+        self.interval = 60.0
+        self.collectors = []
+        self._next = 0
+
+    def config_callback(self, conf):
+        """Creates and configures a sub-collector per Service block."""
+        common = [node for node in conf.children if node.key != 'Service']
+        for node in common:
+            if node.key == 'Interval':
+                self.interval = float(node.values[0])
+
+        for node in conf.children:
+            if node.key != 'Service':
+                continue
+            name = node.values[0].lower()
+            if name not in COLLECTORS:
+                collectd.warning("%s: unknown service: %s" % (self.prefix, name))
+                continue
+            # the services are scheduled on the common interval only
+            options = []
+            for child in node.children:
+                if child.key == 'Interval':
+                    collectd.warning("%s: Interval is ignored in the %s service, set it"
+                            " outside of the Service blocks" % (self.prefix, name))
+                    continue
+                options.append(child)
+            collector = COLLECTORS[name]()
+            collector.config_callback(Config(common + options))
+            self.collectors.append(collector)
+
+        if not self.collectors:
+            collectd.warning("%s: no service configured" % self.prefix)
+            return
+        # every service is collected once per interval, one after the other
+        collectd.register_read(read_callback, self.interval / len(self.collectors))
+
+    def read_callback(self):
+        """Runs the next sub-collector in turn."""
+        collector = self.collectors[self._next % len(self.collectors)]
+        self._next += 1
+        collector.read_callback()
+
+    def shutdown_callback(self):
+        for collector in self.collectors:
+            collector.shutdown_callback()
+
+try:
+    plugin = OpenStackPlugin()
+except Exception as exc:
+    collectd.error("openstack: failed to initialize openstack plugin :: %s :: %s"
+            % (exc, traceback.format_exc()))
+
+def configure_callback(conf):
+    """Received configuration information"""
+    plugin.config_callback(conf)
+
+def read_callback():
+    """Callback triggerred by collectd on read"""
+    plugin.read_callback()
+
+def shutdown_callback():
+    """Callback triggerred by collectd on shutdown"""
+    plugin.shutdown_callback()
+
+collectd.register_config(configure_callback)
+collectd.register_shutdown(shutdown_callback)